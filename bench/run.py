@@ -0,0 +1,180 @@
+#!/usr/bin/python3
+# Headless TermIDE benchmark
+#
+# Starts a real termide under Xvfb (xvfb-run) or the GDK Broadway backend,
+# builds layouts of 1, 16, 64 and 256 panes and measures the round trip of
+# split, close, move, term_add, term_select and reset at every size.
+#
+#   bench/run.py                        print results as JSON
+#   bench/run.py --output out.json      write them to a file as well
+#   bench/run.py --save-baseline        store results as bench/baseline.json
+#   bench/run.py --compare              fail when p50 regresses past --tolerance
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import subprocess
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+from includes.client import Client
+from includes.stats import LatencyHistogram
+
+SIZES = [1, 16, 64, 256]
+BASELINE_PATH = os.path.join(ROOT_DIR, "bench", "baseline.json")
+# fixed options, the user's config must not change the numbers
+CONFIG_PATH = os.path.join(ROOT_DIR, "bench", "termide.json")
+
+
+class Server:
+    def __init__(self, backend):
+        self.path = "/tmp/termide-bench-{}.termide".format(os.getpid())
+        self.backend = backend
+        self.broadwayd = None
+        self.proc = None
+        self.client = Client(self.path, timeout=60)
+
+    def start(self, timeout=30):
+        env = dict(os.environ, TERMIDE_SERVER_PATH=self.path, TERMIDE_CONFIG=CONFIG_PATH)
+        command = [os.path.join(ROOT_DIR, "termide")]
+        if self.backend == "xvfb":
+            command = ["xvfb-run", "-a", "-s", "-screen 0 1920x1080x24"] + command
+        elif self.backend == "broadway":
+            display = ":{}".format(os.getpid() % 1000 + 10)
+            self.broadwayd = subprocess.Popen(
+                ["broadwayd", display],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+            env.update(GDK_BACKEND="broadway", BROADWAY_DISPLAY=display)
+        self.proc = subprocess.Popen(
+            command, env=env, cwd=ROOT_DIR,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                self.call("echo")
+                return
+            except OSError:
+                time.sleep(0.1)
+        self.stop()
+        raise RuntimeError("termide did not come up on {}".format(self.path))
+
+    def call(self, *args):
+        return self.client.call(*args)
+
+    def timed(self, *args):
+        started = time.perf_counter()
+        self.call(*args)
+        return time.perf_counter() - started
+
+    def stop(self):
+        try:
+            self.call("quit")
+        except Exception:
+            pass
+        self.client.close()
+        for proc in (self.proc, self.broadwayd):
+            if proc:
+                try:
+                    proc.wait(5)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def build(server, size):
+    # split every pane once per generation, last index first so the
+    # indexes still to split do not move, alternating the orientation
+    server.call("reset")
+    count, generation = 1, 0
+    while count < size:
+        orient = "h" if generation % 2 == 0 else "v"
+        for tabno in reversed(range(count)):
+            if count >= size:
+                break
+            server.call("split", orient, tabno)
+            count += 1
+        generation += 1
+    # let GTK allocate the new tree before measuring
+    time.sleep(0.5 + size / 100.0)
+    server.call("echo")
+
+def measure(server, size, repeat):
+    results = {}
+    def record(name, seconds):
+        results.setdefault(name, LatencyHistogram()).record(seconds)
+    for i in range(repeat):
+        tabno = i % size
+        record("term_select", server.timed("term_select", 0, tabno))
+        record("move", server.timed("move", "rlud"[i % 4]))
+        record("term_add", server.timed("term_add", tabno))
+        server.call("term_close", -1, tabno)
+        record("split", server.timed("split", "v", tabno))
+        record("close", server.timed("close", tabno + 1))
+    record("reset", server.timed("reset"))
+    return {name: hist.summary() for name, hist in results.items()}
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, sizes in results["results"].items():
+        for size, summary in sizes.items():
+            base = baseline.get("results", {}).get(name, {}).get(size)
+            if not base or not base["p50"]:
+                continue
+            ratio = summary["p50"] / base["p50"]
+            if ratio > 1 + tolerance:
+                regressions.append({
+                    "command": name, "panes": int(size), "p50": summary["p50"],
+                    "baseline_p50": base["p50"], "ratio": round(ratio, 2)
+                })
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="TermIDE layout benchmark")
+    parser.add_argument("--backend", choices=["xvfb", "broadway", "current"], default=(
+        "xvfb" if shutil.which("xvfb-run") else "broadway"
+    ))
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--output")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--compare", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    options = parser.parse_args()
+    if options.compare and not os.path.exists(options.baseline):
+        parser.error("no baseline at {}, run with --save-baseline first".format(options.baseline))
+
+    server = Server(options.backend)
+    server.start()
+    results = {"backend": options.backend, "repeat": options.repeat, "results": {}}
+    try:
+        for size in options.sizes:
+            build(server, size)
+            for name, summary in measure(server, size, options.repeat).items():
+                results["results"].setdefault(name, {})[str(size)] = summary
+        results["server"] = json.loads(server.call("stats")[0])
+    finally:
+        server.stop()
+
+    if options.compare:
+        with open(options.baseline) as f:
+            results["regressions"] = compare(results, json.load(f), options.tolerance)
+    output = json.dumps(results, indent=4)
+    print(output)
+    if options.output:
+        with open(options.output, "w") as f:
+            f.write(output + "\n")
+    if options.save_baseline:
+        with open(options.baseline, "w") as f:
+            f.write(output + "\n")
+    if results.get("regressions"):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -3,19 +3,209 @@
 import os
 import io
 import gi
-import threading
 import json
 import socket
 import subprocess
 import shlex
+import re
+import time
 from time import sleep
 
-from .util import PIPE_PATH, ROOT_DIR, bash, shlex_join, send_command
+from .util import (
+    PIPE_PATH, ROOT_DIR, FRAME_HEADER, LEGACY_START, bash, shlex_join, pack_frame
+)
 
 gi.require_version("Gtk", "3.0")
 gi.require_version('Vte', '2.91')
 
-from gi.repository import GObject
+from gi.repository import GObject, GLib
+
+from . import events
+from .stats import CommandStats
+from .scheduler import scheduler, LOW
+from .layout import load_layout
+from .registry import is_id
+
+# term_get_text sends this many rows per scheduler step, and waits while more than
+# STREAM_BACKLOG bytes are queued for the client
+STREAM_CHUNK_ROWS = 500
+STREAM_BACKLOG = 1024 * 1024
+STREAM_RETRY_MS = 10
+
+
+class Deferred:
+    # returned by commands that answer later, e.g. subscriptions
+    def __init__(self, conn, rid):
+        self.conn = conn
+        self.rid = rid
+        self.done = False
+
+    def reply(self, rows, ok=True):
+        if self.done:
+            return
+        self.done = True
+        if self.conn and not self.conn.closed:
+            self.conn.reply(self.rid, [str(row) for row in rows], ok)
+
+    def chunk(self, rows):
+        # part of a streamed result, the final reply follows
+        if not self.done and self.conn and not self.conn.closed:
+            self.conn.send_chunk(self.rid, rows)
+
+    def backlog(self):
+        # bytes the client has not read yet, producers pause when it grows
+        if self.conn and not self.conn.closed:
+            return len(self.conn.outbuf)
+        return 0
+
+    def abandoned(self):
+        return self.done or not self.conn or self.conn.closed
+
+
+class Connection:
+    # one client socket, driven by GLib IO watches on the main loop
+    def __init__(self, server, sock):
+        self.server = server
+        self.sock = sock
+        self.sock.setblocking(False)
+        self.fd = sock.fileno()
+        self.inbuf = bytearray()
+        self.outbuf = bytearray()
+        self.legacy = None
+        self.received = None
+        self.closing = False
+        self.closed = False
+        self.events = None
+        self.watch_out = None
+        self.watch_in = GLib.io_add_watch(
+            self.fd, GLib.PRIORITY_DEFAULT,
+            GLib.IO_IN | GLib.IO_HUP | GLib.IO_ERR, self.event_in
+        )
+
+    def event_in(self, fd, condition):
+        try:
+            chunk = self.sock.recv(65536)
+        except BlockingIOError:
+            return True
+        except OSError:
+            chunk = b""
+        if not chunk:
+            self.watch_in = None
+            if self.legacy and self.inbuf and not self.closing:
+                # the client is done sending but the request never parsed
+                self.legacy_error("Malformed request")
+                return False
+            self.close()
+            return False
+        self.inbuf += chunk
+        self.received = time.monotonic()
+        self.parse()
+        if self.closed or self.closing:
+            # legacy clients send exactly one request
+            self.watch_in = None
+            return False
+        return True
+
+    def parse(self):
+        if self.legacy is None:
+            self.legacy = self.inbuf[:1] == LEGACY_START
+        if self.legacy:
+            try:
+                args = json.loads(self.inbuf.decode("utf-8"))
+            except json.JSONDecodeError as e:
+                # an error before the end of the input is not a partial request
+                if e.pos < len(e.doc.rstrip()) and not e.msg.startswith("Unterminated"):
+                    self.legacy_error("Malformed request")
+                return
+            except ValueError:
+                return
+            self.inbuf.clear()
+            self.server.dispatch(self, None, args)
+            return
+        while len(self.inbuf) >= FRAME_HEADER.size and not self.closed:
+            length = FRAME_HEADER.unpack_from(self.inbuf)[0]
+            end = FRAME_HEADER.size + length
+            if len(self.inbuf) < end:
+                return
+            payload = bytes(self.inbuf[FRAME_HEADER.size:end])
+            del self.inbuf[:end]
+            try:
+                frame = json.loads(payload.decode("utf-8"))
+                rid, args = frame.get("id"), frame.get("args") or []
+            except (ValueError, AttributeError):
+                # no id to answer to, tell the client and hang up
+                self.reply(None, ["Malformed frame"], False)
+                self.closing = True
+                self.flush()
+                return
+            self.server.dispatch(self, rid, args)
+
+    def legacy_error(self, message):
+        self.inbuf.clear()
+        self.reply(None, [message], False)
+
+    def reply(self, rid, rows, ok=True):
+        if self.legacy:
+            self.send("\n".join(rows).encode("utf-8"))
+            self.closing = True
+            self.flush()
+        else:
+            self.send(pack_frame({"id": rid, "ok": ok, "result": rows}))
+
+    def send_chunk(self, rid, rows):
+        if self.legacy:
+            self.send(("\n".join(rows) + "\n").encode("utf-8"))
+        else:
+            self.send(pack_frame({"id": rid, "chunk": rows}))
+
+    def push_event(self, event):
+        if self.events and event["event"] not in self.events:
+            return
+        if self.legacy:
+            self.send((json.dumps(event) + "\n").encode("utf-8"))
+        else:
+            self.send(pack_frame(event))
+
+    def send(self, data):
+        if self.closed:
+            return
+        self.outbuf += data
+        self.flush()
+
+    def flush(self):
+        if self.outbuf:
+            try:
+                sent = self.sock.send(self.outbuf)
+                del self.outbuf[:sent]
+            except BlockingIOError:
+                pass
+            except OSError:
+                self.close()
+                return
+        if self.outbuf and not self.watch_out:
+            self.watch_out = GLib.io_add_watch(
+                self.fd, GLib.PRIORITY_DEFAULT, GLib.IO_OUT, self.event_out
+            )
+        if not self.outbuf and self.closing:
+            self.close()
+
+    def event_out(self, fd, condition):
+        self.watch_out = None
+        self.flush()
+        return False
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        for watch in (self.watch_in, self.watch_out):
+            if watch:
+                GLib.source_remove(watch)
+        self.watch_in = self.watch_out = None
+        self.sock.close()
+        self.server.connections.discard(self)
+        self.server.subscribers.discard(self)
+
 
 class SocketServer:
     def __init__(self, ide):
@@ -25,103 +215,162 @@ class SocketServer:
             os.remove(PIPE_PATH)        
         self.server.bind(PIPE_PATH)
         self.current_tab = 0
+        self.running = False
+        self.connections = set()
+        self.subscribers = set()
+        self.conn = None
+        self.rid = None
+        self.received = None
+        self.stats = CommandStats()
+        self.watch = None
         self.ide = ide
         self.ide.server = self
     
     def __del__(self):
-        self.server.close()
-        os.remove(PIPE_PATH)
+        self.stop()
 
-    def comm_run(self, conn, comm_method, args):
+    def exec_command(self, args, received=None):
+        comm_method = "command_{}".format(args[0])
+        if not hasattr(self, comm_method):
+            return ["Command {} not found!".format(args[0])]
+        start = time.monotonic()
+        try:
+            retval = getattr(self, comm_method)(*args[1:])
+        finally:
+            stop = time.monotonic()
+            self.stats.record(
+                args[0], start - received if received else 0.0, stop - start
+            )
+        if isinstance(retval, Deferred):
+            return retval
+        return [str(row) for row in retval] if retval else []
+
+    def defer(self):
+        return Deferred(self.conn, self.rid)
+
+    def dispatch(self, conn, rid, args):
+        if not args or args[0] == "stop":
+            conn.reply(rid, [])
+            self.stop()
+            return
+        self.conn, self.rid, self.received = conn, rid, conn.received
         try: 
-            if hasattr(self, comm_method):
-                retval = getattr(self, comm_method)(*args[1:])
-                retval = "\n".join(str(row) for row in retval) if retval else ""
-            else:
-                retval = "Command {} not found!".format(args[1])
-            conn.send(retval.encode("utf-8"))
-            conn.close()
+            retval = self.exec_command(args, conn.received)
+            if not isinstance(retval, Deferred):
+                conn.reply(rid, retval)
         except Exception as e:
             import traceback
-            retval = [str(traceback.format_exc())]
-            retval = "\n".join(str(row) for row in retval) if retval else ""
-            conn.send(retval.encode("utf-8"))   
-            conn.close()
-        print("stop {}".format(comm_method))
+            conn.reply(rid, [str(traceback.format_exc())], ok=False)
+        finally:
+            self.conn, self.rid, self.received = None, None, None
+
+    def broadcast(self, event):
+        for conn in list(self.subscribers):
+            conn.push_event(event)
 
-    def run(self):
+    def event_accept(self, fd, condition):
         while True:
-            self.server.listen(1)
-            conn, addr = self.server.accept()
-            message = conn.recv(1024)
-            if not message:
-                continue
-            args = json.loads(message.decode("utf-8"))
-            if not len(args) or args[0] == "stop":
-                break
-            comm_method = "command_{}".format(args[0])
-            print("start {}".format(comm_method))
-            GObject.idle_add(self.comm_run, conn, comm_method, args)
-            #self.comm_run(conn, comm_method, args)
-        return False
-              
+            try:
+                sock, addr = self.server.accept()
+            except BlockingIOError:
+                return True
+            except OSError:
+                self.watch = None
+                return False
+            self.connections.add(Connection(self, sock))
+
     def start(self):
-        self.thread = threading.Thread(target=self.run)
-        self.thread.start()
+        self.server.listen(64)
+        self.server.setblocking(False)
+        self.running = True
+        events.listen(self.broadcast)
+        self.watch = GLib.io_add_watch(
+            self.server.fileno(), GLib.PRIORITY_DEFAULT, GLib.IO_IN,
+            self.event_accept
+        )
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        events.unlisten(self.broadcast)
+        if self.watch:
+            GLib.source_remove(self.watch)
+            self.watch = None
+        for conn in list(self.connections):
+            conn.flush()
+            conn.close()
+        self.server.close()
+        if os.path.exists(PIPE_PATH):
+            os.remove(PIPE_PATH)
+
+    def get_tab(self, tabno=-1):
+        # layout position, -1 for the current pane, or a pane/terminal id
+        if is_id(tabno):
+            return self.ide.tab(tabno)
+        tabno = int(tabno)
+        return self.ide.tab(self.current_tab if tabno == -1 else tabno)
+
+    def get_term(self, termnum=-1, tabno=-1):
+        if is_id(termnum):
+            return self.ide.registry.terminal(termnum)
+        tab = self.get_tab(tabno)
+        return tab.curterm() if int(termnum) == -1 else tab.terminal(termnum)
+
+    def target_term(self, tabno=-1):
+        # a terminal id means that exact terminal, else the pane's visible one
+        return self.get_term(tabno if is_id(tabno) and tabno[0] == "t" else -1, tabno)
 
     def command_tab(self, current_tab):
-        self.current_tab = int(current_tab)
-        self.ide.tabs[self.current_tab].curterm().grab_focus()
-        return []
+        tab = self.get_tab(current_tab)
+        self.ide.refresh_tabs()
+        self.current_tab = tab.tabno
+        self.ide.focus(tab.curterm())
+        return [tab.pane_id]
+
+    def command_pane_id(self, tabno=-1):
+        return [self.get_tab(tabno).pane_id]
+
+    def command_pane_list(self):
+        self.ide.refresh_tabs()
+        return [json.dumps({
+            "tab": tab.tabno,
+            "pane": tab.pane_id,
+            "active": tab.curterm().term_id,
+            "terminals": [
+                {"term": term.term_id, "title": term.title, "tid": term.tid}
+                for term in tab.terminals
+            ],
+        }) for tab in self.ide.tabs]
         
     def command_split(self, direction="v", tabno=-1):
-        tab = self.ide.tabs[self.current_tab if tabno == -1 else int(tabno)] 
-        tab.split(orient=direction)
-        self.ide.recreate_tabs()
-        tab.curterm().grab_focus()
-        return []
+        tab = self.get_tab(tabno) 
+        newtab = tab.split(orient=direction)
+        self.ide.focus(tab.curterm())
+        return [newtab.pane_id]
 
     def command_close(self, tabno=-1):
-        tab = self.ide.tabs[self.current_tab if tabno == -1 else int(tabno)] 
+        tab = self.get_tab(tabno) 
         tab.get_parent().remove_tab(tab)
         return []
 
     def command_quit(self):
+        if self.ide.restore_session:
+            self.ide.save_session()
         self.ide.event_destroy()
         return []
 
-    def command_move(self, direction="r"):
-        def tabp(tab):
-            geom = tab.stack.get_visible_child().get_allocation()
-            geom2 = tab.translate_coordinates(tab.get_toplevel(), 0, 0)
-            return {
-                "x1": geom2[0], 
-                "y1": geom2[1],
-                "x2": geom2[0]+geom.width, 
-                "y2": geom2[1]+geom.height,
-                "xm": geom2[0]+int(geom.width/2), 
-                "ym": geom2[1]+int(geom.height/2)
-            }
-        curpos = tabp(self.ide.tabs[self.current_tab])
-        minlen = 10000000
-        
-        for tabno, tab in enumerate(self.ide.tabs):
-            if tabno == self.current_tab:
-                continue
-            tabpos = tabp(tab)
-            if direction == "l" and tabpos["x2"] >= curpos["x1"]:
-                continue
-            if direction == "r" and tabpos["x1"] <= curpos["x2"]:
-                continue
-            if direction == "u" and tabpos["y2"] >= curpos["y1"]:
-                continue
-            if direction == "d" and tabpos["y1"] <= curpos["y2"]:
-                continue
-            curlen = abs(tabpos["xm"]-curpos["xm"]) + abs(tabpos["ym"]-curpos["ym"])
-            if curlen < minlen:
-                minlen = curlen
-                self.current_tab = tabno
-        return self.command_tab(self.current_tab)
+    def command_move(self, direction="r", wrap=""):
+        # neighbours come from the geometry cached on size-allocate
+        self.ide.refresh_tabs()
+        if direction in ("last", "back"):
+            target = self.ide.previous_pane
+        else:
+            current = self.ide.tabs[self.current_tab].pane_id
+            target = self.ide.spatial.neighbour(current, direction, wrap == "wrap")
+        if target is None or target not in self.ide.registry.panes:
+            return self.command_tab(self.current_tab)
+        return self.command_tab(target)
             
     def command_server_address(self):
         return [PIPE_PATH]
@@ -129,34 +378,93 @@ class SocketServer:
     def command_echo(self, *args):
         return list(args)
         
+    def command_begin(self, timeout=10):
+        # layout changes until commit are applied in one go
+        self.ide.begin(float(timeout))
+        return []
+
+    def command_commit(self):
+        self.ide.commit()
+        return []
+
+    def command_batch(self, *commands):
+        # replies of deferred commands have no request to go to
+        conn, self.conn = self.conn, None
+        self.ide.begin()
+        retval = []
+        for args in commands:
+            try:
+                result, ok = self.exec_command(args, self.received), True
+                if isinstance(result, Deferred):
+                    result = ["deferred"]
+            except Exception as e:
+                import traceback
+                result, ok = [str(traceback.format_exc())], False
+            retval.append(json.dumps({"command": args, "ok": ok, "result": result}))
+        self.ide.commit()
+        self.conn = conn
+        return retval
+
+    def internal_command(self, action):
+        # "termide <command> ..." bindings are run in-process
+        if len(action) < 2 or os.path.basename(action[0]) != "termide":
+            return None
+        if not hasattr(self, "command_{}".format(action[1])):
+            return None
+        return list(action[1:])
+
+    def command_stats(self, action="show"):
+        # queue wait and execution time per command, in milliseconds
+        if action == "reset":
+            self.stats.reset()
+            scheduler.reset()
+            return []
+        if action == "scheduler":
+            return [json.dumps(scheduler.summary())]
+        return [json.dumps(self.stats.summary())]
+
+    def command_shell_pool(self, size=None):
+        # pre-spawned shells waiting for split and term_add
+        if size is not None:
+            self.ide.pool.resize(size)
+        return [json.dumps(self.ide.pool.summary())]
+
+    def command_subscribe(self, *event_names):
+        # the connection stays open and receives one JSON object per event
+        if not self.conn:
+            return []
+        self.conn.events = set(event_names) if event_names else None
+        self.subscribers.add(self.conn)
+        if self.conn.legacy:
+            return self.defer()
+        return ["subscribed"]
+
     def command_bind(self, keycode, *action):
-        if not keycode in self.ide.keybinds:
-            self.ide.keybinds[keycode] = []    
-        self.ide.keybinds[keycode].append(action)    
+        self.ide.bind(keycode, action, self.internal_command(action))
         return []
 
     def command_resize(self, step_x, step_y, tabno=-1):
-        tab = self.ide.tabs[self.current_tab if tabno == -1 else int(tabno)] 
+        tab = self.get_tab(tabno) 
         tab.get_parent().resize(int(step_x), int(step_y))
 
     def command_resize_first(self, step_x, step_y, tabno=-1):
-        tab = self.ide.tabs[self.current_tab if tabno == -1 else int(tabno)] 
+        tab = self.get_tab(tabno) 
         tab.get_parent().resize_first(int(step_x), int(step_y))
 
     def command_resize_last(self, step_x, step_y, tabno=-1):
-        tab = self.ide.tabs[self.current_tab if tabno == -1 else int(tabno)] 
+        tab = self.get_tab(tabno) 
         tab.get_parent().resize_last(int(step_x), int(step_y))
         
     def command_term_add(self, tabno=-1, title="default", command=None):
         command_lst = json.loads(command) if command else []
-        tab = self.ide.tabs[self.current_tab if tabno == -1 else int(tabno)]
+        tab = self.get_tab(tabno)
         terminal = tab.add_terminal(title, commands=command_lst if command else None)
         tab.stack.set_visible_child(terminal)
-        return []   
+        return [terminal.term_id]
 
     def command_term_get(self, tabno=-1, tid="", title="default", command=None):
         command_lst = json.loads(command) if command else []
-        tab = self.ide.tabs[self.current_tab if tabno == -1 else int(tabno)]
+        tab = self.get_tab(tabno)
         terminal = None
         for term in tab.terminals:
             if getattr(term, "tid") == tid:
@@ -168,17 +476,17 @@ class SocketServer:
             )
             terminal.tid = tid
         tab.stack.set_visible_child(terminal)
-        return []   
+        return [terminal.term_id]
 
 
     def command_term_select(self, termnum, tabno=-1):
-        tab = self.ide.tabs[self.current_tab if tabno == -1 else int(tabno)] 
-        term = tab.terminals[int(termnum)]
+        term = self.get_term(termnum, tabno)
+        tab = term.prnt
         tab.stack.set_visible_child(term)
-        term.grab_focus()
+        self.ide.focus(term)
 
     def command_term_num(self, tabno=-1):
-        tab = self.ide.tabs[self.current_tab if tabno == -1 else int(tabno)] 
+        tab = self.get_tab(tabno) 
         curterm = tab.stack.get_visible_child()
         for i, term in enumerate(tab.terminals):
             if term == curterm:
@@ -186,65 +494,179 @@ class SocketServer:
         return [-1]
     
     def command_term_next(self, tabno=-1):
-        tab = self.ide.tabs[self.current_tab if tabno == -1 else int(tabno)] 
-        termnum = self.command_term_num()[0]
+        tab = self.get_tab(tabno) 
+        termnum = self.command_term_num(tabno)[0]
         if termnum + 1 >= len(tab.terminals):
             return [-1]
         termnum += 1
-        self.command_term_select(termnum)
+        self.command_term_select(termnum, tabno)
         return [termnum]
 
     def command_term_prev(self, tabno=-1):
-        tab = self.ide.tabs[self.current_tab if tabno == -1 else int(tabno)] 
-        termnum = self.command_term_num()[0]
+        tab = self.get_tab(tabno) 
+        termnum = self.command_term_num(tabno)[0]
         if termnum <= 0:
             return [-1]
         termnum -= 1
-        self.command_term_select(termnum)
+        self.command_term_select(termnum, tabno)
         return [termnum]
     
     def command_term_list(self, tabno=-1):
-        tab = self.ide.tabs[self.current_tab if tabno == -1 else int(tabno)] 
+        tab = self.get_tab(tabno) 
         return [term.title for term in tab.terminals]
 
-    def command_term_close(self, termnum=-1, tabno=-1):
-        tab = self.ide.tabs[self.current_tab if tabno == -1 else int(tabno)] 
-        term = (
-            tab.terminals[int(termnum)] 
-            if termnum != -1 
-            else tab.stack.get_visible_child()
+    def command_term_search(self, pattern, limit=100, flags=""):
+        # regex over the indexed output of every terminal, "i" ignores case
+        self.ide.refresh_tabs()
+        terms = {term.term_id: (tab, term) for tab in self.ide.tabs for term in tab.terminals}
+        found = self.ide.search_index.search(
+            pattern, int(limit), "i" in flags, set(terms)
         )
-        tab.stack.remove(term)
+        rows = []
+        for term_id, matches in found.items():
+            tab, term = terms[term_id]
+            for line, text in matches:
+                rows.append(json.dumps({
+                    "tab": tab.tabno, "pane": tab.pane_id, "term": term_id,
+                    "title": term.title, "line": line, "text": text,
+                }))
+        return rows
+
+    def command_term_memory(self, action="show"):
+        # estimated scrollback and search index bytes per terminal,
+        # trim applies the budget now
+        trimmed = self.ide.enforce_scrollback() if action == "trim" else {}
+        infos = self.ide.memory_info()
+        rows = [json.dumps({
+            "term": info["key"],
+            "rows": info["rows"],
+            "limit": info["limit"],
+            "bytes": info["bytes"],
+            "index_lines": info["index_lines"],
+            "index_bytes": info["index_bytes"],
+            "hidden": info["hidden"],
+            "trimmed": info["key"] in trimmed,
+        }) for info in infos]
+        rows.append(json.dumps({
+            "total": sum(info["bytes"] + info["index_bytes"] for info in infos),
+            "budget": self.ide.scrollback_budget,
+        }))
+        return rows
+
+    def command_term_status(self, termnum=-1, tabno=-1):
+        # lazy until first shown, spawning until the child runs, failed if it never will
+        term = self.get_term(termnum, tabno)
+        return [json.dumps({
+            "term": term.term_id,
+            "state": term.spawn_state(),
+            "pid": term.pid,
+            "error": term.spawn_error,
+        })]
+
+    def command_term_close(self, termnum=-1, tabno=-1):
+        term = self.get_term(termnum, tabno)
+        term.prnt.rem_terminal(term.termno)
         return []
 
+    def command_term_wait(self, pattern, timeout=30, tabno=-1):
+        # answers with the first new line matching pattern, or fails on timeout
+        term = self.target_term(tabno)
+        regex = re.compile(pattern)
+        deferred = self.defer()
+        state = {"timer": None, "destroy": None}
+
+        def finish(rows, ok):
+            term.remove_line_watcher(on_lines)
+            if state["timer"]:
+                GLib.source_remove(state["timer"])
+                state["timer"] = None
+            if state["destroy"]:
+                term.disconnect(state["destroy"])
+                state["destroy"] = None
+            deferred.reply(rows, ok)
+
+        def on_lines(lines):
+            if deferred.abandoned():
+                # the client went away, stop watching
+                finish([], False)
+                return
+            for line in lines:
+                if regex.search(line):
+                    finish([line], True)
+                    return
+
+        def on_timeout():
+            state["timer"] = None
+            finish(["timeout waiting for {}".format(pattern)], False)
+            return False
+
+        def on_destroy(*args):
+            finish(["terminal {} closed".format(term.term_id)], False)
+
+        term.add_line_watcher(on_lines)
+        state["destroy"] = term.connect("destroy", on_destroy)
+        state["timer"] = GLib.timeout_add(int(float(timeout) * 1000), on_timeout)
+        return deferred
+
     def command_term_scale(self, change=0, tabno=-1):
-        tab = self.ide.tabs[self.current_tab if tabno == -1 else int(tabno)] 
+        tab = self.get_tab(tabno) 
         for term in tab.terminals:
             term.set_font_scale(term.get_font_scale()+float(change))
         return [term.get_font_scale()]        
 
     def command_term_set_scale(self, val=0, tabno=-1):
-        tab = self.ide.tabs[self.current_tab if tabno == -1 else int(tabno)] 
+        tab = self.get_tab(tabno) 
         for term in tab.terminals:
             term.set_font_scale(float(val))
         return [term.get_font_scale()]        
 
+    def command_term_get_text(self, what="screen", termnum=-1, tabno=-1):
+        # streamed in chunks from the scheduler, big scrollbacks never block GTK
+        term = self.get_term(termnum, tabno)
+        first, last = term.row_range(what)
+        deferred = self.defer()
+        state = {"row": first}
+
+        def step():
+            if deferred.abandoned():
+                return
+            if term.term_id not in self.ide.registry.terms:
+                # closed while streaming, the widget is gone
+                deferred.reply(["terminal {} closed".format(term.term_id)], False)
+                return
+            if deferred.backlog() > STREAM_BACKLOG:
+                # the client is behind, try again once it read some
+                GLib.timeout_add(STREAM_RETRY_MS, resume)
+                return
+            row = state["row"]
+            end = min(row + STREAM_CHUNK_ROWS, last)
+            if row < end:
+                deferred.chunk(term.get_rows(row, end))
+                state["row"] = end
+            if end >= last:
+                deferred.reply([])
+            else:
+                scheduler.schedule(step, priority=LOW)
+
+        def resume():
+            scheduler.schedule(step, priority=LOW)
+            return False
+
+        scheduler.schedule(step, priority=LOW)
+        return deferred
+
     def command_term_feed(self, val="", tabno=-1):
-        tab = self.ide.tabs[self.current_tab if tabno == -1 else int(tabno)] 
-        term = tab.stack.get_visible_child() 
-        val2 = (val+"\n")
-        term.feed_child(val2, len(val2))
+        term = self.target_term(tabno)
+        term.feed_line(val)
         return []        
 
     def command_clipboard_paste(self, tabno=-1):
-        tab = self.ide.tabs[self.current_tab if tabno == -1 else int(tabno)] 
-        term = tab.stack.get_visible_child() 
+        term = self.target_term(tabno)
         term.paste_clipboard()
         return []
 
     def command_clipboard_copy(self, tabno=-1):
-        tab = self.ide.tabs[self.current_tab if tabno == -1 else int(tabno)] 
-        term = tab.stack.get_visible_child() 
+        term = self.target_term(tabno)
         term.copy_clipboard()
         return []
 
@@ -272,3 +694,20 @@ class SocketServer:
         self.ide.reset()
         return []
 
+    def command_save_session(self, path=""):
+        self.ide.save_session(path)
+        return [path if path else self.ide.session_path]
+
+    def command_restore_session(self, path=""):
+        self.ide.apply_layout(load_layout(path if path else self.ide.session_path))
+        return []
+
+    def command_layout(self, source):
+        # file, templates/<name>.json or inline JSON, built in one pass
+        self.ide.apply_layout(load_layout(source))
+        return []
+
+    def command_layout_apply(self, source):
+        # like layout, but terminals matching by tid or title and cwd survive
+        return [json.dumps(self.ide.apply_layout(load_layout(source), reconcile=True))]
+
@@ -0,0 +1,273 @@
+# TermIDE client library, shared by script/termide, the tools and the benchmark
+#
+#   client = Client()
+#   client.call("split", "v")                        one request, one reply
+#   client.pipeline([["split", "v"], ["tab", "1"]])  many requests, one flush
+#   for rows in client.stream("term_get_text", "all")  chunks as they arrive
+#   async with AsyncClient() as client:
+#       await client.call("term_list")
+
+import os
+import json
+import socket
+import asyncio
+
+from .util import PIPE_PATH, FRAME_HEADER, pack_frame, recv_frame
+
+
+class CommandError(Exception):
+    pass
+
+
+def encode_args(args):
+    # batches nest argument lists, everything else goes over as strings
+    return [arg if isinstance(arg, (str, list)) else str(arg) for arg in args]
+
+def default_path():
+    return os.environ.get("TERMIDE_PIPE_PATH") or PIPE_PATH
+
+def request_oneshot(path, args, timeout=None):
+    # legacy protocol: plain JSON in, everything until EOF out
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(timeout)
+    try:
+        client.connect(path)
+        client.sendall(json.dumps(args).encode("utf-8"))
+        resp = bytearray()
+        while True:
+            chunk = client.recv(65536)
+            if not chunk:
+                break
+            resp += chunk
+    finally:
+        client.close()
+    return resp.decode("utf-8")
+
+
+class Client:
+    def __init__(self, path=None, timeout=None):
+        self.path = path if path else default_path()
+        self.timeout = timeout
+        self.sock = None
+        self.rid = 0
+        self.replies = {}
+        self.chunks = {}
+        self.events = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def connect(self):
+        if self.sock is None:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.settimeout(self.timeout)
+            try:
+                self.sock.connect(self.path)
+            except OSError:
+                self.close()
+                raise
+        return self.sock
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        self.replies = {}
+        self.chunks = {}
+
+    def submit(self, *args):
+        # send without waiting, the reply is collected by result()
+        return self.submit_many([args])[0]
+
+    def submit_many(self, commands):
+        rids = []
+        payload = bytearray()
+        for args in commands:
+            self.rid += 1
+            rids.append(self.rid)
+            payload += pack_frame({"id": self.rid, "args": encode_args(args)})
+        try:
+            self.connect().sendall(payload)
+        except OSError:
+            self.close()
+            raise
+        return rids
+
+    def read(self):
+        try:
+            frame = recv_frame(self.sock)
+        except (OSError, ValueError):
+            self.close()
+            raise
+        if frame is None:
+            self.close()
+            raise ConnectionError("termide closed the connection")
+        return frame
+
+    def store(self, frame):
+        # streamed chunks are collected until their final reply
+        if "chunk" in frame:
+            self.chunks.setdefault(frame["id"], []).extend(frame["chunk"])
+            return
+        frame["result"] = self.chunks.pop(frame["id"], []) + frame["result"]
+        self.replies[frame["id"]] = frame
+
+    def reply(self, rid):
+        while rid not in self.replies:
+            frame = self.read()
+            if "id" in frame:
+                self.store(frame)
+            else:
+                self.events.append(frame)
+        return self.replies.pop(rid)
+
+    def result(self, rid):
+        frame = self.reply(rid)
+        if not frame["ok"]:
+            raise CommandError("\n".join(frame["result"]))
+        return frame["result"]
+
+    def call(self, *args):
+        if self.sock is None:
+            return self.result(self.submit(*args))
+        try:
+            rid = self.submit(*args)
+        except OSError:
+            # the pooled connection went stale, the server may have restarted
+            rid = self.submit(*args)
+        return self.result(rid)
+
+    def pipeline(self, commands):
+        return [self.result(rid) for rid in self.submit_many(commands)]
+
+    def stream(self, *args):
+        # yields each chunk of rows, the final reply's rows come last
+        rid = self.submit(*args)
+        while rid not in self.replies:
+            if self.chunks.get(rid):
+                yield self.chunks.pop(rid)
+                continue
+            frame = self.read()
+            if frame.get("id") == rid and "chunk" in frame:
+                yield frame["chunk"]
+            elif "id" in frame:
+                self.store(frame)
+            else:
+                self.events.append(frame)
+        rows = self.result(rid)
+        if rows:
+            yield rows
+
+    def next_event(self):
+        if self.events:
+            return self.events.pop(0)
+        while True:
+            frame = self.read()
+            if "id" in frame:
+                self.store(frame)
+            else:
+                return frame
+
+    def iter_events(self):
+        while True:
+            yield self.next_event()
+
+
+pool = {}
+
+def get_client(path=None, timeout=None):
+    # one reusable connection per server
+    path = path if path else default_path()
+    if path not in pool:
+        pool[path] = Client(path, timeout)
+    return pool[path]
+
+
+class AsyncClient:
+    def __init__(self, path=None, timeout=None):
+        self.path = path if path else default_path()
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+        self.reader_task = None
+        self.rid = 0
+        self.pending = {}
+        self.chunks = {}
+        self.events = asyncio.Queue()
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def connect(self):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_unix_connection(self.path)
+            self.reader_task = asyncio.ensure_future(self.read_loop())
+
+    async def close(self):
+        if self.reader_task:
+            self.reader_task.cancel()
+            self.reader_task = None
+        if self.writer:
+            self.writer.close()
+            self.writer = None
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError("connection closed"))
+        self.pending = {}
+
+    async def read_loop(self):
+        try:
+            while True:
+                header = await self.reader.readexactly(FRAME_HEADER.size)
+                payload = await self.reader.readexactly(FRAME_HEADER.unpack(header)[0])
+                frame = json.loads(payload.decode("utf-8"))
+                if "chunk" in frame:
+                    self.chunks.setdefault(frame["id"], []).extend(frame["chunk"])
+                    continue
+                if "id" in frame and frame["id"] in self.chunks:
+                    frame["result"] = self.chunks.pop(frame["id"]) + frame["result"]
+                future = self.pending.pop(frame.get("id"), None) if "id" in frame else None
+                if future and not future.done():
+                    future.set_result(frame)
+                elif "id" not in frame:
+                    self.events.put_nowait(frame)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("termide closed the connection"))
+            self.pending = {}
+
+    def send(self, args):
+        self.rid += 1
+        future = asyncio.get_event_loop().create_future()
+        self.pending[self.rid] = future
+        self.writer.write(pack_frame({"id": self.rid, "args": encode_args(args)}))
+        return future
+
+    async def wait(self, future):
+        frame = await asyncio.wait_for(future, self.timeout)
+        if not frame["ok"]:
+            raise CommandError("\n".join(frame["result"]))
+        return frame["result"]
+
+    async def call(self, *args):
+        await self.connect()
+        future = self.send(args)
+        await self.writer.drain()
+        return await self.wait(future)
+
+    async def pipeline(self, commands):
+        await self.connect()
+        futures = [self.send(args) for args in commands]
+        await self.writer.drain()
+        return [await self.wait(future) for future in futures]
+
+    async def next_event(self):
+        return await self.events.get()
@@ -0,0 +1,40 @@
+# TermIDE startup configuration
+
+import os
+import json
+
+from .util import ROOT_DIR
+
+CONFIG_PATHS = [
+    os.path.join(os.path.expanduser("~"), ".config", "termide", "termide.json"),
+    os.path.join(ROOT_DIR, "conf", "termide.json"),
+]
+MODIFIERS = ["Control", "Lock", "Shift", "Alt"]
+
+def config_path():
+    if os.environ.get("TERMIDE_CONFIG"):
+        return os.environ["TERMIDE_CONFIG"]
+    for path in CONFIG_PATHS:
+        if os.path.exists(path):
+            return path
+    return None
+
+def load_config(path=None):
+    path = path if path else config_path()
+    config = {"options": {}, "startup": [], "keybinds": {}}
+    if path:
+        with open(path) as f:
+            config.update(json.load(f))
+    return config
+
+def normalize_keycode(keycode):
+    # same form as TermIDE.event_keypress builds: modifiers in fixed order
+    parts = keycode.split("+")
+    mods = [mod for mod in MODIFIERS if mod.lower() in map(str.lower, parts[:-1])]
+    return "+".join(mods + [parts[-1].capitalize()])
+
+def keybind_actions(value):
+    # a binding is one argv list or a list of them
+    if value and isinstance(value[0], str):
+        return [value]
+    return value
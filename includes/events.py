@@ -0,0 +1,15 @@
+# TermIDE event bus, widgets emit and the socket server streams to subscribers
+
+listeners = []
+
+def listen(callback):
+    listeners.append(callback)
+
+def unlisten(callback):
+    if callback in listeners:
+        listeners.remove(callback)
+
+def emit(event, **data):
+    data["event"] = event
+    for callback in list(listeners):
+        callback(data)
@@ -0,0 +1,74 @@
+# TermIDE layout files
+#
+# {
+#     "cd": "~/project",                  default directory for new terminals
+#     "maximize": true,
+#     "focus": 0,                         pane to focus, in layout order
+#     "layout": {
+#         "split": "h",                   "v" stacks first over last
+#         "position": -640,               pixels, negative counts from the end
+#         "ratio": 0.3,                   or a fraction of the split size
+#         "first": {...},
+#         "last": {
+#             "active": 0,                visible terminal of the pane
+#             "terminals": [{
+#                 "title": "server", "tid": "server", "cwd": "src",
+#                 "command": ["python3"], "scale": 0.9,
+#                 "feed": ["source env/bin/activate", "python manage.py runserver"]
+#             }]
+#         }
+#     }
+# }
+
+import os
+import json
+
+from .util import ROOT_DIR
+
+LAYOUT_DIR = os.path.join(ROOT_DIR, "templates")
+SESSION_PATH = os.path.join(os.path.expanduser("~"), ".cache", "termide", "session.json")
+
+
+def load_layout(source):
+    # inline JSON, a path, or the name of a file in templates/
+    source = source.strip()
+    if source.startswith("{"):
+        layout = json.loads(source)
+    else:
+        path = os.path.expanduser(source)
+        if not os.path.exists(path):
+            path = os.path.join(LAYOUT_DIR, source + ".json")
+        with open(path) as f:
+            layout = json.load(f)
+    if "layout" not in layout:
+        layout = {"layout": layout}
+    return layout
+
+
+def save_layout(layout, path):
+    path = os.path.expanduser(path)
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump(layout, f, indent=4)
+    os.replace(path + ".tmp", path)
+
+
+def is_split(node):
+    return "split" in node
+
+
+def node_terminals(node):
+    return node.get("terminals") or [{}]
+
+
+def terminal_feed(spec):
+    feed = spec.get("feed") or []
+    return [feed] if isinstance(feed, str) else feed
+
+
+def resolve_dir(directory, base):
+    if not directory:
+        return None
+    directory = os.path.expanduser(directory)
+    return directory if os.path.isabs(directory) else os.path.join(base, directory)
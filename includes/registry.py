@@ -0,0 +1,41 @@
+# TermIDE pane registry, stable ids for panes (TermTabs) and terminals
+
+import itertools
+
+
+class PaneRegistry:
+    def __init__(self):
+        self.ids = itertools.count(1)
+        self.panes = {}
+        self.terms = {}
+
+    def add_pane(self, pane):
+        pane.pane_id = "p{}".format(next(self.ids))
+        self.panes[pane.pane_id] = pane
+
+    def add_terminal(self, term):
+        term.term_id = "t{}".format(next(self.ids))
+        self.terms[term.term_id] = term
+
+    def remove_pane(self, pane):
+        self.panes.pop(pane.pane_id, None)
+
+    def remove_terminal(self, term):
+        self.terms.pop(term.term_id, None)
+
+    def pane(self, ident):
+        # a terminal id resolves to the pane holding it
+        if ident in self.panes:
+            return self.panes[ident]
+        if ident in self.terms:
+            return self.terms[ident].prnt
+        raise KeyError("No pane {}".format(ident))
+
+    def terminal(self, ident):
+        if ident in self.terms:
+            return self.terms[ident]
+        raise KeyError("No terminal {}".format(ident))
+
+
+def is_id(value):
+    return isinstance(value, str) and value[:1] in ("p", "t") and value[1:].isdigit()
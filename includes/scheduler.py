@@ -0,0 +1,106 @@
+# TermIDE deferred work, runs from the GLib main loop only when something is queued
+#
+# Work is kept in one deque per priority. A wakeup drains as much as fits in
+# the frame budget, highest priority first, then yields back to GTK so input
+# and redraws are not starved. Work queued with a key replaces a pending item
+# with the same key instead of running twice.
+
+import time
+from collections import deque
+
+from gi.repository import GLib
+
+from .stats import LatencyHistogram
+
+HIGH = 0
+DEFAULT = 1
+LOW = 2
+
+# seconds of work per wakeup, about half a 60Hz frame
+FRAME_BUDGET = 0.008
+
+
+class Scheduler:
+    def __init__(self, budget=FRAME_BUDGET):
+        self.budget = budget
+        self.queues = (deque(), deque(), deque())
+        self.keyed = {}
+        self.source = None
+        self.reset()
+
+    def schedule(self, callback, *params, priority=DEFAULT, key=None):
+        if key is not None and key in self.keyed:
+            # coalesce, the item keeps its place and its original queue time
+            item = self.keyed[key]
+            item[0], item[1] = callback, params
+            self.coalesced += 1
+            return
+        item = [callback, params, time.monotonic(), key]
+        if key is not None:
+            self.keyed[key] = item
+        self.queues[priority].append(item)
+        self.max_depth = max(self.max_depth, len(self))
+        if self.source is None:
+            self.source = GLib.idle_add(self.run)
+
+    def __len__(self):
+        return sum(len(queue) for queue in self.queues)
+
+    def pop(self):
+        for queue in self.queues:
+            if queue:
+                item = queue.popleft()
+                if item[3] is not None:
+                    self.keyed.pop(item[3], None)
+                return item
+        return None
+
+    def run(self):
+        self.wakeups += 1
+        start = time.monotonic()
+        self.depth_total += len(self)
+        # at least one item per wakeup, then as many as fit in the budget
+        while True:
+            item = self.pop()
+            if item is None:
+                break
+            callback, params, queued, key = item
+            now = time.monotonic()
+            self.wait.record(now - queued)
+            self.executed += 1
+            try:
+                callback(*params)
+            except Exception as e:
+                print("scheduled {} failed: {}".format(callback, e))
+            if time.monotonic() - start >= self.budget:
+                break
+        if len(self):
+            self.over_budget += 1
+            return True
+        self.source = None
+        return False
+
+    def summary(self):
+        return {
+            "wakeups": self.wakeups,
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "over_budget": self.over_budget,
+            "queued": [len(queue) for queue in self.queues],
+            # queue length seen at each wakeup, and the peak after any schedule
+            "mean_depth": round(self.depth_total / self.wakeups, 2) if self.wakeups else 0.0,
+            "max_depth": self.max_depth,
+            "wait": self.wait.summary(),
+        }
+
+    def reset(self):
+        self.wakeups = 0
+        self.executed = 0
+        self.coalesced = 0
+        self.over_budget = 0
+        self.max_depth = 0
+        self.depth_total = 0
+        self.wait = LatencyHistogram()
+
+
+scheduler = Scheduler()
@@ -0,0 +1,64 @@
+# TermIDE scrollback accounting, decides which terminals give up history
+#
+# VTE does not report its memory, so usage is estimated from the rows kept
+# in scrollback times the column count, plus what the search index holds for
+# the terminal. Terminals are described as dicts:
+#   {"key": ..., "rows": scrollback rows, "columns": n, "hidden": bool,
+#    "focused": bool, "index_lines": n, "index_bytes": n}
+
+import math
+
+# VTE keeps scrollback in a compressed stream, text plus attributes,
+# this errs on the generous side
+BYTES_PER_CELL = 8
+
+# never trim a terminal below this many rows
+MIN_LINES = 200
+
+
+def kept_rows(lower, upper, screen_rows):
+    # the vadjustment counts every row ever printed, rows below lower are gone
+    return max(int(upper) - int(lower) - screen_rows, 0)
+
+
+def estimate_bytes(rows, columns):
+    return rows * columns * BYTES_PER_CELL
+
+
+def term_bytes(term):
+    return estimate_bytes(term["rows"], term["columns"]) + term.get("index_bytes", 0)
+
+
+def usage(terms):
+    return sum(term_bytes(term) for term in terms)
+
+
+def trim_order(terms, hidden_first=True):
+    # hidden pages, then unfocused, then the focused one, biggest first
+    def rank(term):
+        size = term_bytes(term)
+        if not hidden_first:
+            return (0, -size)
+        return (0 if term["hidden"] else 1 if not term["focused"] else 2, -size)
+    return sorted(terms, key=rank)
+
+
+def plan(terms, budget, hidden_first=True, min_lines=MIN_LINES):
+    # {key: rows to keep} for the terminals that have to shrink,
+    # the same count applies to the scrollback and the search index
+    over = usage(terms) - budget
+    result = {}
+    for term in trim_order(terms, hidden_first):
+        if over <= 0:
+            break
+        rows = max(term["rows"], term.get("index_lines", 0))
+        spare = rows - min_lines
+        if spare <= 0:
+            continue
+        per_row = term_bytes(term) / rows
+        if not per_row:
+            continue
+        drop = min(spare, int(math.ceil(over / per_row)))
+        result[term["key"]] = rows - drop
+        over -= drop * per_row
+    return result
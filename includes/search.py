@@ -0,0 +1,186 @@
+# TermIDE output index, regex search over what every terminal has printed
+#
+# Lines are kept per terminal in blocks. Each block has a small bloom filter
+# of the (lowercased) trigrams in its lines, so a search only runs the regex
+# over blocks that may contain every literal the pattern requires. A full
+# block is packed into one string. Old blocks are dropped once a terminal
+# holds more than max_lines lines or max_bytes of text.
+
+import re
+from collections import deque
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+BLOCK_LINES = 256
+MAX_LINES = 50000
+MAX_BYTES = 4 * 1024 * 1024
+
+# bits per block filter, one hash per trigram
+BLOOM_BITS = 16384
+BLOOM_MASK = BLOOM_BITS - 1
+
+# fixed cost of a block besides its text and filter, a rough figure
+BLOCK_OVERHEAD = 200
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def required_literals(pattern):
+    # literal runs every match has to contain, lowercased, [] if unsure
+    try:
+        parsed = sre_parse.parse(pattern)
+    except Exception:
+        return []
+    runs, current = [], []
+    for op, value in parsed:
+        if op is sre_parse.LITERAL:
+            current.append(chr(value))
+            continue
+        if current:
+            runs.append("".join(current))
+            current = []
+    if current:
+        runs.append("".join(current))
+    return [run.lower() for run in runs if len(run) >= 3]
+
+
+def bloom_bits(grams):
+    return [hash(gram) & BLOOM_MASK for gram in grams]
+
+
+class Block:
+    def __init__(self, first):
+        self.first = first
+        self.pending = []
+        self.text = ""
+        self.count = 0
+        self.size = 0
+        self.bloom = bytearray(BLOOM_BITS // 8)
+
+    def add(self, lines):
+        self.pending.extend(lines)
+        self.count += len(lines)
+        text = "\n".join(lines)
+        self.size += len(text) + 1
+        # trigrams of the whole batch at once, repeated prefixes count once
+        bloom = self.bloom
+        for bit in bloom_bits(trigrams(text.lower())):
+            bloom[bit >> 3] |= 1 << (bit & 7)
+
+    def pack(self):
+        # one string per full block instead of a list of them
+        self.text = "\n".join(self.pending)
+        self.pending = []
+
+    def lines(self):
+        return self.pending if self.pending else self.text.split("\n")
+
+    def may_contain(self, bits):
+        bloom = self.bloom
+        return all(bloom[bit >> 3] & (1 << (bit & 7)) for bit in bits)
+
+    def memory(self):
+        return self.size + len(self.bloom) + BLOCK_OVERHEAD
+
+
+class TermIndex:
+    def __init__(self, max_lines=MAX_LINES, max_bytes=MAX_BYTES):
+        self.blocks = deque()
+        self.count = 0
+        self.lines = 0
+        self.size = 0
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+
+    def add(self, lines):
+        lines = list(lines)
+        while lines:
+            if not self.blocks or self.blocks[-1].count >= BLOCK_LINES:
+                if self.blocks:
+                    self.blocks[-1].pack()
+                self.blocks.append(Block(self.count))
+            block = self.blocks[-1]
+            part, lines = lines[:BLOCK_LINES - block.count], lines[BLOCK_LINES - block.count:]
+            size = block.size
+            block.add(part)
+            self.size += block.size - size
+            self.count += len(part)
+            self.lines += len(part)
+        while len(self.blocks) > 1 and (
+            self.lines > self.max_lines or self.memory() > self.max_bytes
+        ):
+            self.drop_oldest()
+
+    def drop_oldest(self):
+        block = self.blocks.popleft()
+        self.lines -= block.count
+        self.size -= block.size
+
+    def trim(self, keep):
+        # keep about the newest keep lines, whole blocks go
+        while len(self.blocks) > 1 and self.lines - self.blocks[0].count >= keep:
+            self.drop_oldest()
+
+    def memory(self):
+        return self.size + len(self.blocks) * (BLOOM_BITS // 8 + BLOCK_OVERHEAD)
+
+    def search(self, regex, bits, limit):
+        # (line number, text) of matches, oldest first
+        found = []
+        for block in self.blocks:
+            if bits and not block.may_contain(bits):
+                continue
+            for offset, line in enumerate(block.lines()):
+                if regex.search(line):
+                    found.append((block.first + offset, line))
+                    if len(found) >= limit:
+                        return found
+        return found
+
+
+class SearchIndex:
+    def __init__(self, max_lines=MAX_LINES, max_bytes=MAX_BYTES):
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        self.terms = {}
+
+    def add(self, key, lines):
+        if key not in self.terms:
+            self.terms[key] = TermIndex(self.max_lines, self.max_bytes)
+        self.terms[key].add(lines)
+
+    def remove(self, key):
+        self.terms.pop(key, None)
+
+    def trim(self, key, keep):
+        if key in self.terms:
+            self.terms[key].trim(keep)
+
+    def memory(self, key):
+        # (lines, estimated bytes) held for key
+        index = self.terms.get(key)
+        return (index.lines, index.memory()) if index else (0, 0)
+
+    def search(self, pattern, limit=100, ignore_case=False, keys=None):
+        # {key: [(line number, text), ...]} with at most limit matches in total
+        regex = re.compile(pattern, re.IGNORECASE if ignore_case else 0)
+        grams = set()
+        for literal in required_literals(pattern):
+            grams.update(trigrams(literal))
+        bits = bloom_bits(grams)
+        result = {}
+        for key, index in self.terms.items():
+            if keys is not None and key not in keys:
+                continue
+            found = index.search(regex, bits, limit)
+            if found:
+                result[key] = found
+                limit -= len(found)
+                if limit <= 0:
+                    break
+        return result
@@ -0,0 +1,86 @@
+# TermIDE spatial index for directional pane navigation
+#
+# Pane rectangles are pushed in on size-allocate. Neighbour lookups are
+# memoized per pane and direction until a rectangle changes, so repeated
+# Alt+Arrow presses do not rescan the layout.
+
+OPPOSITE = {"l": "r", "r": "l", "u": "d", "d": "u"}
+
+
+def midpoint(rect):
+    x1, y1, x2, y2 = rect
+    return (x1 + x2) // 2, (y1 + y2) // 2
+
+
+def beyond(rect, cur, direction):
+    if direction == "l":
+        return rect[2] < cur[0]
+    if direction == "r":
+        return rect[0] > cur[2]
+    if direction == "u":
+        return rect[3] < cur[1]
+    if direction == "d":
+        return rect[1] > cur[3]
+    return False
+
+
+def distance(rect, cur):
+    xm, ym = midpoint(rect)
+    cxm, cym = midpoint(cur)
+    return abs(xm - cxm) + abs(ym - cym)
+
+
+class SpatialIndex:
+    def __init__(self):
+        self.rects = {}
+        self.cache = {}
+
+    def update(self, key, rect):
+        if self.rects.get(key) != rect:
+            self.rects[key] = rect
+            self.cache = {}
+
+    def remove(self, key):
+        if self.rects.pop(key, None) is not None:
+            self.cache = {}
+
+    def neighbour(self, key, direction, wrap=False):
+        if key not in self.rects:
+            return None
+        cache_key = (key, direction, wrap)
+        if cache_key not in self.cache:
+            found = self.find(key, direction)
+            if found is None and wrap:
+                found = self.wrap_target(key, direction)
+            self.cache[cache_key] = found
+        return self.cache[cache_key]
+
+    def find(self, key, direction):
+        cur = self.rects[key]
+        best, bestlen = None, None
+        for other, rect in self.rects.items():
+            if other == key or not beyond(rect, cur, direction):
+                continue
+            curlen = distance(rect, cur)
+            if bestlen is None or curlen < bestlen:
+                best, bestlen = other, curlen
+        return best
+
+    def wrap_target(self, key, direction):
+        # the pane on the opposite edge, closest to us across the other axis
+        cur = self.rects[key]
+        cxm, cym = midpoint(cur)
+        def rank(item):
+            rect = item[1]
+            xm, ym = midpoint(rect)
+            if direction == "r":
+                return (rect[0], abs(ym - cym))
+            if direction == "l":
+                return (-rect[2], abs(ym - cym))
+            if direction == "d":
+                return (rect[1], abs(xm - cxm))
+            return (-rect[3], abs(xm - cxm))
+        others = [item for item in self.rects.items() if item[0] != key]
+        if not others or direction not in OPPOSITE:
+            return None
+        return min(others, key=rank)[0]
@@ -0,0 +1,70 @@
+# TermIDE latency instrumentation
+
+import math
+
+# quarter octave buckets starting at 1us, the last one catches everything
+BUCKETS_PER_OCTAVE = 4
+BUCKET_COUNT = 30 * BUCKETS_PER_OCTAVE
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.buckets = [0] * BUCKET_COUNT
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        micros = max(seconds * 1000000, 1)
+        index = min(int(math.log2(micros) * BUCKETS_PER_OCTAVE), BUCKET_COUNT - 1)
+        self.buckets[index] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, pct):
+        # upper bound of the bucket holding the pct-th sample, in seconds
+        if not self.count:
+            return 0.0
+        rank = math.ceil(self.count * pct / 100.0)
+        seen = 0
+        for index, amount in enumerate(self.buckets):
+            seen += amount
+            if seen >= rank:
+                upper = 2 ** ((index + 1) / BUCKETS_PER_OCTAVE) / 1000000
+                return min(upper, self.max)
+        return self.max
+
+    def summary(self):
+        # milliseconds, rounded for humans
+        def ms(seconds):
+            return round(seconds * 1000, 3)
+        return {
+            "count": self.count,
+            "mean": ms(self.total / self.count) if self.count else 0.0,
+            "p50": ms(self.percentile(50)),
+            "p90": ms(self.percentile(90)),
+            "p99": ms(self.percentile(99)),
+            "max": ms(self.max),
+        }
+
+
+class CommandStats:
+    def __init__(self):
+        self.commands = {}
+
+    def record(self, command, queue_wait, exec_time):
+        if command not in self.commands:
+            self.commands[command] = (LatencyHistogram(), LatencyHistogram())
+        queue, execution = self.commands[command]
+        queue.record(queue_wait)
+        execution.record(exec_time)
+
+    def summary(self):
+        return {
+            command: {"queue": queue.summary(), "exec": execution.summary()}
+            for command, (queue, execution) in sorted(self.commands.items())
+        }
+
+    def reset(self):
+        self.commands = {}
@@ -16,13 +16,11 @@ def error_log(msg):
 # ------------ client side ------------------
 
 if action != "init":
-    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-    client.connect(server_path)
-    client.send(json.dumps(sys.argv[2:]).encode("utf-8"))
-    resp = client.recv(20480).decode("utf-8")
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from includes.client import request_oneshot
+    resp = request_oneshot(server_path, sys.argv[2:])
     if resp:
         print(resp)
-    client.close()
     sys.exit()
 
 # ------------ server side ------------------
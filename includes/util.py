@@ -1,11 +1,21 @@
+
 import os
 import shlex
 import socket
+import struct
 import json
 
-PIPE_PATH = "/tmp/{}.termide".format(os.getpid())
+PIPE_PATH = (
+    os.environ.get("TERMIDE_SERVER_PATH") or "/tmp/{}.termide".format(os.getpid())
+)
 ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
+# framed protocol: 4 byte big endian length followed by a JSON object
+# requests are {"id": n, "args": [...]}, replies {"id": n, "ok": bool, "result": [...]}
+# a connection starting with "[" is a legacy one-shot JSON request
+FRAME_HEADER = struct.Struct(">I")
+LEGACY_START = b"["
+
 def bash():
     return [
         "/bin/bash", "--rcfile", 
@@ -15,10 +25,27 @@ def bash():
 def shlex_join(split_command):
     return ' '.join(shlex.quote(arg) for arg in split_command)
 
-def send_command(cmd):
-    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-    client.connect(PIPE_PATH)
-    client.send(json.dumps(cmd).encode("utf-8"))
-    retval = client.recv(2048)
-    client.close()
-    return retval
+def pack_frame(obj):
+    payload = json.dumps(obj).encode("utf-8")
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+def recv_exact(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(min(size - len(data), 65536))
+        if not chunk:
+            return None
+        data += chunk
+    return bytes(data)
+
+def recv_frame(sock):
+    header = recv_exact(sock, FRAME_HEADER.size)
+    if header is None:
+        return None
+    payload = recv_exact(sock, FRAME_HEADER.unpack(header)[0])
+    if payload is None:
+        return None
+    return json.loads(payload.decode("utf-8"))
+
+def send_frame(sock, obj):
+    sock.sendall(pack_frame(obj))
@@ -8,6 +8,7 @@ import json
 import socket
 import subprocess
 import shlex
+from collections import deque
 
 
 gi.require_version("Gtk", "3.0")
@@ -17,41 +18,293 @@ from gi.repository import Gtk, Vte, Gdk
 from gi.repository import GLib, GObject
 
 
-from .util import PIPE_PATH, ROOT_DIR, bash, shlex_join, send_command
+from .util import PIPE_PATH, ROOT_DIR, bash, shlex_join
+from .config import normalize_keycode, keybind_actions
+from . import events
+from . import scrollback
+from .registry import PaneRegistry, is_id
+from .spatial import SpatialIndex
+from .search import SearchIndex
+from . import search
+from .scheduler import scheduler, DEFAULT, LOW
+from .layout import (
+    SESSION_PATH, is_split, node_terminals, terminal_feed, resolve_dir,
+    load_layout, save_layout
+)
+
+
+class LayoutTransaction:
+    # containers created between begin and commit are shown at commit,
+    # so the new tree is allocated once instead of after every change
+    def __init__(self):
+        self.depth = 0
+        self.widgets = []
+
+    def show(self, widget):
+        if self.depth:
+            self.widgets.append(widget)
+        else:
+            widget.show()
+
+    def flush(self):
+        widgets, self.widgets = self.widgets, []
+        for widget in widgets:
+            if widget.get_parent():
+                widget.show()
+
+transaction = LayoutTransaction()
+registry = PaneRegistry()
+spatial = SpatialIndex()
+search_index = SearchIndex()
+# lines indexed per scheduler step and terminal
+INDEX_STEP_LINES = 500
 
 
 class Terminal(Vte.Terminal):
     default_dir = os.getcwd()
+    lazy_pages = False
+    scrollback_lines = None
+    replay_jobs = False
     
-    def __init__(self, title, directory=None, commands = []):
+    def __init__(self, title, directory=None, commands = [], lazy=False):
         super().__init__()
         self.title = title
+        registry.add_terminal(self)
+        self.connect("destroy", self.event_destroy)
+        self.directory = directory if directory else self.default_dir
+        self.commands = commands if commands else None
         self.set_color_background(Gdk.RGBA(0.2, 0.2, 0.2, 1))
         self.set_clear_background(False)
-        self.spawn_sync(
-            Vte.PtyFlags.DEFAULT,
-            directory if directory else self.default_dir,
-            commands if commands else bash(), 
-            [
-                "TERMIDE_PIPE_PATH={}".format(PIPE_PATH),
-                "PATH={}".format(os.environ["PATH"] + os.pathsep + os.path.join(ROOT_DIR, "script"))
-            ],
-            GLib.SpawnFlags.DO_NOT_REAP_CHILD,
-            None, None,
-        )
+        if self.scrollback_lines is not None:
+            self.set_scrollback_lines(self.scrollback_lines)
+        self.prnt = None
+        self.pid = None
+        self.spawn_error = None
+        self.spawn_started = False
+        self.exit_reason = "closed"
+        # lines the layout typed at start, saved again with the session
+        self.startup_feed = []
+        self.pending_input = []
         self.connect("eof", self.event_eof)
         self.connect("focus_in_event", self.event_focus)
+        self.connect("window-title-changed", self.event_title_changed)
+        self.connect("current-directory-uri-changed", self.event_cwd_changed)
+        self.connect("contents-changed", self.event_contents_changed)
+        self.line_watchers = []
+        self.scan_row = 0
+        self.scan_upper = 0
+        # lines waiting for the search index, older ones would be dropped anyway
+        self.index_pending = deque(maxlen=search.MAX_LINES)
         self.termno = -1
         self.tid = None
-        self.add_tick_callback(self.tick_cb)
+        # everything printed goes to the search index
+        self.add_line_watcher(self.event_lines)
+        if lazy:
+            # a hidden stack page, the child starts when the page is first shown
+            self.connect("map", self.event_map)
+        else:
+            self.spawn()
+
+    def event_map(self, *args):
+        if not self.spawn_started:
+            self.spawn()
+
+    def spawn(self):
+        # the widget shows right away, the pty is attached once the child runs
+        self.spawn_started = True
+        argv = self.commands if self.commands else bash()
+        env = [
+            "TERMIDE_PIPE_PATH={}".format(PIPE_PATH),
+            "TERMIDE_SERVER_PATH=",
+            "PATH={}".format(os.environ["PATH"] + os.pathsep + os.path.join(ROOT_DIR, "script"))
+        ]
+        if not hasattr(self, "spawn_async"):
+            # vte older than 0.48
+            try:
+                spawned = self.spawn_sync(
+                    Vte.PtyFlags.DEFAULT, self.directory, argv, env,
+                    GLib.SpawnFlags.DO_NOT_REAP_CHILD, None, None,
+                )
+                self.event_spawned(self, spawned[1], None)
+            except GLib.Error as e:
+                self.event_spawned(self, -1, e)
+            return
+        self.spawn_async(
+            Vte.PtyFlags.DEFAULT, self.directory, argv, env,
+            GLib.SpawnFlags.DO_NOT_REAP_CHILD, None, None,
+            -1, None, self.event_spawned, None
+        )
+
+    def event_spawned(self, terminal, pid, error, *args):
+        if error is not None or pid is None or pid < 0:
+            self.spawn_error = error.message if error is not None else "spawn failed"
+            print("spawn failed:", self.spawn_error)
+            self.pending_input = []
+            self.feed("termide: {}\r\n".format(self.spawn_error).encode())
+            events.emit(
+                "term_spawn_failed", term=self.term_id, title=self.title,
+                error=self.spawn_error
+            )
+            return
+        self.pid = pid
+        events.emit("term_spawned", term=self.term_id, title=self.title, pid=self.pid)
+        pending, self.pending_input = self.pending_input, []
+        for text in pending:
+            self.feed_line(text)
+
+    def spawn_state(self):
+        if self.spawn_error:
+            return "failed"
+        if not self.spawn_started:
+            return "lazy"
+        return "running" if self.pid else "spawning"
         
     def event_eof(self, event):
         print("eof caught");
+        self.exit_reason = "eof"
+        if self.prnt is None:
+            # a pooled shell that died before anyone took it
+            pool.discard(self)
+            return
         self.prnt.rem_terminal(self.termno)
 
+    def event_destroy(self, *args):
+        # every way a terminal goes away ends here, eof, term_close, close, reset
+        if self.term_id not in registry.terms:
+            return
+        registry.remove_terminal(self)
+        search_index.remove(self.term_id)
+        events.emit(
+            "term_exited", term=self.term_id, title=self.title, pid=self.pid,
+            reason=self.exit_reason
+        )
+
+    def event_lines(self, lines):
+        # indexed later in small steps, a big cat must not stall the main loop
+        self.index_pending.extend(lines)
+        scheduler.schedule(self.index_step, priority=LOW, key=("search", self.term_id))
+
+    def index_step(self):
+        if self.term_id not in registry.terms:
+            return
+        count = min(len(self.index_pending), INDEX_STEP_LINES)
+        search_index.add(self.term_id, [self.index_pending.popleft() for i in range(count)])
+        if self.index_pending:
+            scheduler.schedule(self.index_step, priority=LOW, key=("search", self.term_id))
+
+    def event_title_changed(self, *args):
+        events.emit(
+            "title_changed", term=self.term_id, title=self.title, pid=self.pid,
+            window_title=self.get_window_title()
+        )
+
+    def event_cwd_changed(self, *args):
+        events.emit(
+            "cwd_changed", term=self.term_id, title=self.title, pid=self.pid,
+            uri=self.get_current_directory_uri()
+        )
+
     def event_focus(self, *args):
         self.prnt.tab_focused()
 
+    def event_contents_changed(self, *args):
+        # only rows above the cursor are complete, hand those out once
+        if not self.line_watchers:
+            return
+        row = self.get_cursor_position()[1]
+        upper = int(self.get_vadjustment().get_upper())
+        if upper < self.scan_upper:
+            # the buffer shrank (reset, clear), rows below are new again
+            self.scan_row = min(self.scan_row, row)
+        self.scan_upper = upper
+        # the cursor moving up (editors, fzf redraws) does not repeat rows,
+        # only output past the highest row seen so far is handed out
+        if row <= self.scan_row:
+            return
+        lines = self.get_rows(self.scan_row, row)
+        self.scan_row = row
+        for watcher in list(self.line_watchers):
+            watcher(lines)
+
+    def add_line_watcher(self, watcher):
+        if not self.line_watchers:
+            self.scan_row = self.get_cursor_position()[1]
+        self.line_watchers.append(watcher)
+
+    def remove_line_watcher(self, watcher):
+        if watcher in self.line_watchers:
+            self.line_watchers.remove(watcher)
+
+    def feed_line(self, text):
+        if self.pid is None:
+            # no child yet, typed once it is running
+            if not self.spawn_error:
+                self.pending_input.append(text)
+            return
+        text = text + "\n"
+        self.feed_child(text, len(text))
+
+    def get_rows(self, start_row, end_row):
+        # text of rows start_row..end_row-1, soft wrapped rows come back joined
+        if end_row <= start_row:
+            return []
+        end_col = self.get_column_count()
+        if hasattr(self, "get_text_range_format"):
+            text = self.get_text_range_format(
+                Vte.Format.TEXT, start_row, 0, end_row - 1, end_col
+            )[0]
+        else:
+            text = self.get_text_range(
+                start_row, 0, end_row - 1, end_col, None, None
+            )[0]
+        return (text or "").splitlines()
+
+    def row_range(self, what="screen"):
+        # "screen", "all" (scrollback + screen) or "start:end" rows,
+        # negative rows count from the end, like python slices
+        adj = self.get_vadjustment()
+        lower, upper = int(adj.get_lower()), int(adj.get_upper())
+        if what == "all":
+            return lower, upper
+        if what == "screen":
+            top = int(adj.get_value())
+            return top, top + self.get_row_count()
+        start, _, end = what.partition(":")
+        def row(value, default):
+            if not value:
+                return default
+            value = int(value)
+            return upper + value if value < 0 else lower + value
+        start, end = row(start, lower), row(end, upper)
+        return max(start, lower), min(end, upper)
+
+    def scrollback_rows(self):
+        # rows kept above the screen, lower and upper are absolute row numbers
+        adj = self.get_vadjustment()
+        return scrollback.kept_rows(adj.get_lower(), adj.get_upper(), self.get_row_count())
+
+    def memory_info(self, focused=False):
+        rows = self.scrollback_rows()
+        index_lines, index_bytes = search_index.memory(self.term_id)
+        return {
+            "key": self.term_id,
+            "rows": rows,
+            "columns": self.get_column_count(),
+            "limit": self.get_scrollback_lines(),
+            "bytes": scrollback.estimate_bytes(rows, self.get_column_count()),
+            "index_lines": index_lines,
+            "index_bytes": index_bytes,
+            "hidden": not self.get_mapped(),
+            "focused": focused,
+        }
+
+    def trim_scrollback(self, keep):
+        # shrinking the limit drops the oldest rows, then it may grow again
+        # the limit counts the rows on screen as well
+        limit = self.get_scrollback_lines()
+        self.set_scrollback_lines(keep + self.get_row_count())
+        self.set_scrollback_lines(limit)
+
     def getcwd(self):
         return self.default_dir
         try:
@@ -61,8 +314,52 @@ class Terminal(Vte.Terminal):
             print(e)
             return None
 
-    def tick_cb(self, *args):
-        self.prnt.tick_cb()
+    def current_dir(self):
+        # reported by the shell (OSC 7) if it does, else the shell's own cwd,
+        # else where it was started
+        uri = self.get_current_directory_uri()
+        if uri:
+            try:
+                return GLib.filename_from_uri(uri)[0]
+            except Exception:
+                pass
+        if self.pid:
+            try:
+                return os.readlink("/proc/{}/cwd".format(self.pid))
+            except OSError:
+                pass
+        return self.directory
+
+    def foreground_command(self):
+        # argv of the job running in the shell, None at the prompt
+        try:
+            pgid = os.tcgetpgrp(self.get_pty().get_fd())
+            if pgid == self.pid:
+                return None
+            with open("/proc/{}/cmdline".format(pgid), "rb") as f:
+                argv = f.read().decode("utf-8", "replace").split("\0")
+            return [arg for arg in argv if arg] or None
+        except (OSError, AttributeError):
+            return None
+
+    def snapshot(self):
+        spec = {
+            "title": self.title,
+            "cwd": self.current_dir(),
+            "scale": self.get_font_scale(),
+        }
+        if self.tid:
+            spec["tid"] = self.tid
+        if self.commands:
+            spec["command"] = self.commands
+        elif self.startup_feed:
+            spec["feed"] = self.startup_feed
+        elif self.replay_jobs:
+            # opt in, the job is typed again on restore without its setup
+            job = self.foreground_command()
+            if job:
+                spec["feed"] = [shlex_join(job)]
+        return spec
             
             
 class SingleTerminalWindow(Gtk.Window):
@@ -85,21 +382,27 @@ class SingleTerminalWindow(Gtk.Window):
 
     def tab_focused(self):
         pass
-
-    def tick_cb(self, *args):
-        pass
         
 class TermTabs(Gtk.Box):
-    def add_terminal(self, title, directory=None, commands=[]):
+    def add_terminal(self, title, directory=None, commands=[], terminal=None):
         title = title if title else "Default"
         scale = 1
         if not directory and self.terminals:
             term = self.stack.get_visible_child()
             directory = term.getcwd()
             scale = term.get_font_scale()
-        term = Terminal(title, directory, commands)
-        if scale != 1:
-            term.set_font_scale(scale)
+        if terminal:
+            # an existing terminal moved here, keeps its child and scrollback
+            term = terminal
+            title = term.title
+        else:
+            # pages behind the first one stay unspawned until shown, if enabled
+            lazy = Terminal.lazy_pages and bool(self.terminals)
+            term = pool.take(title, directory) if not commands and not lazy else None
+            if term is None:
+                term = Terminal(title, directory, commands, lazy)
+            if scale != 1:
+                term.set_font_scale(scale)
         term.prnt = self
         term.termno = len(self.terminals)
         self.terminals.append(term)
@@ -107,11 +410,13 @@ class TermTabs(Gtk.Box):
         term.show()
         if len(self.terminals) > 1:
             self.switcher.show()
-        self.add_tick_callback(self.tick_cb)
         return term
 
-    def tick_cb(self, *args):
-        self.get_parent().tick_cb()
+    def detach_terminal(self, term):
+        self.stack.remove(term)
+        self.terminals.remove(term)
+        for index, terminal in enumerate(self.terminals):
+            terminal.termno = index
 
     def rem_terminal(self, termno):
         print("rem_terminal", termno, self.tabno)
@@ -128,8 +433,10 @@ class TermTabs(Gtk.Box):
             self.switcher.hide()
         
                             
-    def __init__(self, title=None, directory=None, commands=[]):
+    def __init__(self, title=None, directory=None, commands=[], terminal=None):
         super().__init__(orientation=Gtk.Orientation.VERTICAL, spacing=2)
+        registry.add_pane(self)
+        self.connect("destroy", self.event_destroy)
         self.stack = Gtk.Stack()
         self.set_border_width(10)
         #stack
@@ -144,21 +451,51 @@ class TermTabs(Gtk.Box):
         self.pack_start(self.stack, True, True, 0)        
         #initial
         self.terminals = []
-        self.add_terminal(title, directory, commands)
+        self.add_terminal(title, directory, commands, terminal)
         self.pos = ""
         self.ide = None
         self.tabno = -1
         self.connect("focus-in-event", self.event_focus_in)
-        self.add_tick_callback(self.tick_cb)
+        self.connect("size-allocate", self.event_size_allocate)
         
     def get_tabs(self):
         return [self]
+
+    def event_size_allocate(self, widget, allocation):
+        # cache our rectangle in toplevel coordinates for move
+        toplevel = self.get_toplevel()
+        if toplevel is self:
+            return
+        origin = self.translate_coordinates(toplevel, 0, 0)
+        if origin:
+            x, y = origin
+            spatial.update(self.pane_id, (x, y, x + allocation.width, y + allocation.height))
+
+    def snapshot(self):
+        curterm = self.curterm()
+        return {
+            "active": self.terminals.index(curterm) if curterm in self.terminals else 0,
+            "terminals": [term.snapshot() for term in self.terminals],
+        }
         
+    def event_destroy(self, *args):
+        registry.remove_pane(self)
+        spatial.remove(self.pane_id)
+
+    def terminal(self, termnum):
+        if is_id(termnum):
+            return registry.terminal(termnum)
+        return self.terminals[int(termnum)]
+
     def split(self, title=None, directory=None, commands=[], orient="v"):
         term = self.stack.get_visible_child()
         if not directory:
             directory = term.getcwd()
-        self.get_parent().split(self, title, directory, commands, orient)
+        newtab = self.get_parent().split(self, title, directory, commands, orient)
+        if self.ide:
+            self.ide.tab_inserted(self, newtab)
+        events.emit("split", pane=self.pane_id, new_pane=newtab.pane_id, orient=orient)
+        return newtab
 
     def event_focus_in(self):
         if self.ide:
@@ -189,17 +526,46 @@ class TermSplit(Gtk.Paned):
         self.last = tablast
         self.pack1(tabfirst, True, True)
         self.pack2(tablast, True, True)
-        self.show()
-        self.first.show()
-        self.last.show()
-        self.add_tick_callback(self.tick_cb)
+        self.pending_last = None
+        self.pending_ratio = None
+        transaction.show(self.first)
+        transaction.show(self.last)
+        transaction.show(self)
+        self.connect("size-allocate", self.event_size_allocate)
+
+    def event_size_allocate(self, widget, allocation):
+        # positions set before the first allocation (batches, layouts)
+        size = allocation.width if self.orient == "h" else allocation.height
+        if self.pending_last is not None:
+            self.set_position(size - self.pending_last)
+            self.pending_last = None
+        if self.pending_ratio is not None:
+            self.set_position(int(size * self.pending_ratio))
+            self.pending_ratio = None
 
-    def tick_cb(self, *args):
-        self.get_parent().tick_cb()
+    def set_layout_position(self, position=None, ratio=None):
+        if ratio is not None:
+            self.pending_ratio = float(ratio)
+        elif position is not None and int(position) < 0:
+            self.pending_last = -int(position)
+        elif position is not None:
+            self.set_position(int(position))
 
     def get_tabs(self):
         return self.first.get_tabs() + self.last.get_tabs()
 
+    def snapshot(self):
+        allocation = self.get_allocation()
+        size = allocation.width if self.orient == "h" else allocation.height
+        node = {"split": self.orient}
+        if size > 1:
+            node["ratio"] = round(self.get_position() / size, 4)
+        else:
+            node["position"] = self.get_position()
+        node["first"] = self.first.snapshot()
+        node["last"] = self.last.snapshot()
+        return node
+
     def split(self, tab, title=None, directory=None, commands=[], orient="v"):
         oldtab = self.first if tab.pos == "first" else self.last
         newtab = TermTabs(title, directory, commands)
@@ -210,37 +576,42 @@ class TermSplit(Gtk.Paned):
             self.first = TermSplit(oldtab, newtab, orient)
             self.pack1(self.first, True, True)
             self.first.pos = "first"
-            self.first.show()
+            transaction.show(self.first)
         else:   
             self.last = TermSplit(oldtab, newtab, orient)
             self.pack2(self.last, True, True)
             self.last.pos = "last"
-            self.last.show()
+            transaction.show(self.last)
         self.set_position(lastpos)
+        return newtab
     
     def remove_tab(self, obj):
+        events.emit("close", pane=obj.pane_id)
         self.remove(self.last)
         self.remove(self.first)
         ide = self.get_toplevel()
+        ide.refresh_tabs()
+        # the sibling takes the removed pane's place in layout order
         if obj.pos == "first":
             self.get_parent().replace_obj(self, self.last)
-            ide.server.current_tab = 0            
+            ide.server.current_tab = obj.tabno
         else:
             self.get_parent().replace_obj(self, self.first)
-            ide.server.current_tab -= 1
-        ide.recreate_tabs()
-        ide.tabs[ide.server.current_tab].stack.get_visible_child().grab_focus()
+            ide.server.current_tab = obj.tabno - 1
+        ide.tab_removed(obj)
+        obj.destroy()
+        ide.focus(ide.tab(ide.server.current_tab).stack.get_visible_child())
     
     def replace_obj(self, oldobj, newobj):
         self.remove(oldobj)
         lastpos = self.get_position()
         if oldobj.pos == "first":
             self.pack1(newobj)
-            newobj.show()
+            transaction.show(newobj)
             self.first = newobj
         else:
             self.pack2(newobj)
-            newobj.show()
+            transaction.show(newobj)
             self.last = newobj
         self.set_position(lastpos)    
     
@@ -266,29 +637,207 @@ class TermSplit(Gtk.Paned):
             self.get_parent().resize_last(step_x, step_y)
         return True
 
+    def set_position_last(self, step, size):
+        if size <= 1:
+            self.pending_last = step
+        else:
+            self.set_position(size - step)
+
     def resize_last(self, step_x, step_y):
         print(self.get_position())
         if step_x and self.orient == "h":
-            self.set_position(self.get_allocation().width - step_x)
+            self.set_position_last(step_x, self.get_allocation().width)
             step_x = 0
         if step_y and self.orient == "v":
-            self.set_position(self.get_allocation().height - step_y)
+            self.set_position_last(step_y, self.get_allocation().height)
             step_y = 0
         if step_x or step_y:
             self.get_parent().resize_last(step_x, step_y)
         return True
 
 
+class ReusableTerminals:
+    # terminals of the current tree that a new layout may adopt
+    # matched by tid first, then by title and working directory
+    def __init__(self, tabs):
+        self.keys = {}
+        self.taken = set()
+        self.total = 0
+        self.created = 0
+        for tab in tabs:
+            for term in tab.terminals:
+                self.total += 1
+                if term.tid:
+                    self.keys.setdefault(("tid", term.tid), []).append(term)
+                key = ("title", term.title, os.path.normpath(term.current_dir()))
+                self.keys.setdefault(key, []).append(term)
+
+    def take(self, spec, directory):
+        if spec.get("tid"):
+            key = ("tid", spec["tid"])
+        else:
+            key = ("title", spec.get("title") or "Default", os.path.normpath(directory))
+        for term in self.keys.get(key, []):
+            if term not in self.taken:
+                self.taken.add(term)
+                return term
+        self.created += 1
+        return None
+
+    def summary(self):
+        return {
+            "kept": len(self.taken), "created": self.created,
+            "destroyed": self.total - len(self.taken)
+        }
+
+
+class ShellPool:
+    # plain shells started ahead of time, so split and term_add skip the rcfile
+    def __init__(self):
+        self.size = 0
+        self.shells = deque()
+
+    def resize(self, size):
+        self.size = max(int(size), 0)
+        while len(self.shells) > self.size:
+            self.shells.pop().destroy()
+        self.refill()
+
+    def refill(self):
+        if len(self.shells) < self.size:
+            scheduler.schedule(self.spawn_one, priority=LOW, key="shell_pool")
+
+    def spawn_one(self):
+        if len(self.shells) < self.size:
+            self.shells.append(Terminal("Default"))
+        self.refill()
+
+    def discard(self, term):
+        if term in self.shells:
+            self.shells.remove(term)
+            term.destroy()
+        self.refill()
+
+    def take(self, title, directory=None):
+        term = None
+        while self.shells and term is None:
+            term = self.shells.popleft()
+            if term.spawn_error:
+                term.destroy()
+                term = None
+        if term is None:
+            return None
+        self.refill()
+        term.title = title
+        directory = directory if directory else Terminal.default_dir
+        if os.path.normpath(directory) != os.path.normpath(term.directory):
+            # the leading space keeps it out of the history only with
+            # HISTCONTROL=ignorespace or ignoreboth set in the shell
+            term.directory = directory
+            term.feed_line(" cd {} && clear".format(shlex.quote(directory)))
+        return term
+
+    def summary(self):
+        return {
+            "size": self.size,
+            "ready": sum(1 for term in self.shells if term.spawn_state() == "running"),
+            "spawning": sum(1 for term in self.shells if term.spawn_state() == "spawning"),
+        }
+
+
+pool = ShellPool()
+
+
 class TermIDE(Gtk.Window):
     def recreate_tabs(self):
+        self.tabs_dirty = True
+        if not transaction.depth:
+            self.refresh_tabs()
+
+    def refresh_tabs(self):
+        # inside a transaction the walk happens on first use only
+        if not self.tabs_dirty:
+            return
         self.tabs = self.content.get_tabs()
-        for tabno, tab in enumerate(self.tabs):
-            tab.tabno = tabno
+        self.tabs_dirty = False
+        for tab in self.tabs:
             tab.ide = self
+        self.renumber_tabs()
+
+    def tab(self, tabno):
+        if is_id(tabno):
+            return registry.pane(tabno)
+        self.refresh_tabs()
+        return self.tabs[int(tabno)]
+
+    def tab_inserted(self, after, newtab):
+        # splits put the new pane right after the old one in layout order
+        newtab.ide = self
+        if self.tabs_dirty:
+            return
+        self.tabs.insert(after.tabno + 1, newtab)
+        self.renumber_tabs(after.tabno + 1)
+
+    def tab_removed(self, tab):
+        if self.tabs_dirty:
+            return
+        del self.tabs[tab.tabno]
+        self.renumber_tabs(tab.tabno)
+
+    def renumber_tabs(self, start=0):
+        for tabno in range(start, len(self.tabs)):
+            self.tabs[tabno].tabno = tabno
+
+    def focus(self, widget):
+        if transaction.depth:
+            self.pending_focus = widget
+        else:
+            widget.grab_focus()
+
+    def begin(self, timeout=None):
+        transaction.depth += 1
+        if transaction.depth == 1 and self.get_window():
+            self.frozen_window = self.get_window()
+            self.frozen_window.freeze_updates()
+        if timeout and not self.commit_timer:
+            # a client that never commits must not freeze the window
+            self.commit_timer = GLib.timeout_add(int(timeout * 1000), self.event_commit_timeout)
+
+    def event_commit_timeout(self):
+        self.commit_timer = None
+        while transaction.depth:
+            self.commit()
+        return False
+
+    def commit(self):
+        if not transaction.depth:
+            return
+        transaction.depth -= 1
+        if transaction.depth:
+            return
+        if self.commit_timer:
+            GLib.source_remove(self.commit_timer)
+            self.commit_timer = None
+        transaction.flush()
+        if self.tabs_dirty:
+            self.recreate_tabs()
+        if self.pending_focus:
+            focus, self.pending_focus = self.pending_focus, None
+            focus.grab_focus()
+        if self.frozen_window:
+            self.frozen_window.thaw_updates()
+            self.frozen_window = None
+        self.queue_resize()
 
     def __init__(self, title="TERMIDE", directory=None, commands=[]):
         super().__init__(title=title)
         self.tabs = []
+        self.tabs_dirty = False
+        self.pending_focus = None
+        self.commit_timer = None
+        self.frozen_window = None
+        if directory:
+            Terminal.default_dir = os.path.expanduser(directory)
         self.connect("destroy", self.event_destroy)
         self.connect("key_press_event", self.event_keypress)
         self.resize(900, 600)
@@ -298,27 +847,97 @@ class TermIDE(Gtk.Window):
         self.server = None
         self.pipe_path = "tmp/{}.termide".format(os.getpid())
         self.keybinds = {}
+        self.keycodes = {}
+        self.registry = registry
+        self.spatial = spatial
+        self.pool = pool
+        self.search_index = search_index
+        self.scrollback_budget = 0
+        self.trim_hidden_first = True
+        self.scrollback_timer = None
+        self.focused_tab = -1
+        self.focused_pane = None
+        self.previous_pane = None
+        self.session_path = SESSION_PATH
+        self.restore_session = False
         self.show()
-        self.add_tick_callback(self.tick_cb)
-        self.update_cb = []
 
     def reset(self):
+        self.set_content(TermTabs("default"))
+
+    def set_content(self, content):
         if self.content:
             self.remove(self.content)
             self.content.destroy()
-        self.content = TermTabs("default")
+        self.content = content
         self.add(self.content)
-        self.content.show()
+        transaction.show(self.content)
         self.content.prnt = self
         self.recreate_tabs()
+
+    def build_layout(self, node, base, reuse=None):
+        # builds the whole widget tree off-screen, it is mounted once
+        if is_split(node):
+            split = TermSplit(
+                self.build_layout(node["first"], base, reuse),
+                self.build_layout(node["last"], base, reuse),
+                node["split"]
+            )
+            split.set_layout_position(node.get("position"), node.get("ratio"))
+            return split
+        specs = node_terminals(node)
+        tab = None
+        for spec in specs:
+            directory = resolve_dir(spec.get("cwd"), base) or base
+            existing = reuse.take(spec, directory) if reuse else None
+            if existing:
+                existing.prnt.detach_terminal(existing)
+            if tab is None:
+                tab = TermTabs(spec.get("title"), directory, spec.get("command"), existing)
+                term = tab.terminals[0]
+            else:
+                term = tab.add_terminal(
+                    spec.get("title"), directory, spec.get("command"), existing
+                )
+            if spec.get("tid"):
+                term.tid = spec["tid"]
+            if spec.get("scale"):
+                term.set_font_scale(float(spec["scale"]))
+            if existing:
+                continue
+            term.startup_feed = terminal_feed(spec)
+            for line in term.startup_feed:
+                term.feed_line(line)
+        active = int(node.get("active", 0))
+        if 0 <= active < len(tab.terminals):
+            tab.stack.set_visible_child(tab.terminals[active])
+        return tab
+
+    def snapshot(self):
+        return {
+            "cd": Terminal.default_dir,
+            "maximize": self.is_maximized(),
+            "focus": self.server.current_tab if self.server else 0,
+            "layout": self.content.snapshot(),
+        }
+
+    def apply_layout(self, layout, reconcile=False):
+        if layout.get("cd"):
+            Terminal.default_dir = os.path.expanduser(layout["cd"])
+        if layout.get("maximize"):
+            self.maximize()
+        self.refresh_tabs()
+        reuse = ReusableTerminals(self.tabs) if reconcile else None
+        self.set_content(self.build_layout(layout["layout"], Terminal.default_dir, reuse))
+        focus = int(layout.get("focus", 0))
+        self.refresh_tabs()
+        if 0 <= focus < len(self.tabs):
+            self.server.current_tab = focus
+            self.focus(self.tabs[focus].curterm())
+        return reuse.summary() if reuse else {}
         
-    def update_tick(self, callback, params):
-        self.update_cb.append((callback, params))
-        
-    def tick_cb(self, *args):
-        if self.update_cb:
-            self.update_cb[0][0](*self.update_cb[0][1])
-            self.update_cb = self.update_cb[1:]
+    def update_tick(self, callback, params, priority=DEFAULT, key=None):
+        scheduler.schedule(callback, *params, priority=priority, key=key)
     
     def resize(self, step_x, step_y):
         pass
@@ -342,7 +961,7 @@ class TermIDE(Gtk.Window):
                 stdin=None, stdout=None, stderr=None
             )
              
-    def event_keypress(self, widget, event):
+    def keycode(self, event):
         #decode keycode
         keycode = []
         if event.state & Gdk.ModifierType.CONTROL_MASK:
@@ -354,16 +973,111 @@ class TermIDE(Gtk.Window):
         if event.state & Gdk.ModifierType.MOD1_MASK:
             keycode.append("Alt")
         keycode.append(Gdk.keyval_name(event.keyval).capitalize())
-        keycode = "+".join(keycode)
+        return "+".join(keycode)
+
+    def event_keypress(self, widget, event):
+        state = event.state & (
+            Gdk.ModifierType.CONTROL_MASK | Gdk.ModifierType.LOCK_MASK
+            | Gdk.ModifierType.SHIFT_MASK | Gdk.ModifierType.MOD1_MASK
+        )
+        keycode = self.keycodes.get((int(state), event.keyval))
+        if keycode is None:
+            keycode = self.keycode(event)
+            self.keycodes[(int(state), event.keyval)] = keycode
         #execute action
         if keycode in self.keybinds:
-            for action in self.keybinds[keycode]:
-                #GObject.idle_add(self.shell_exec, action)
-                self.shell_exec(action, wait=False)
+            for action, internal in self.keybinds[keycode]:
+                if internal:
+                    self.run_internal(internal)
+                else:
+                    self.shell_exec(action, wait=False)
             return True
+
+    def bind(self, keycode, action, internal=None):
+        keycode = normalize_keycode(keycode)
+        if not keycode in self.keybinds:
+            self.keybinds[keycode] = []
+        self.keybinds[keycode].append((action, internal))
+
+    def load_config(self, config):
+        options = config.get("options", {})
+        if options.get("maximize"):
+            self.maximize()
+        self.session_path = os.path.expanduser(options.get("session_path", SESSION_PATH))
+        self.restore_session = bool(options.get("restore_session"))
+        pool.resize(options.get("shell_pool", 0))
+        self.set_scrollback_budget(options.get("scrollback", {}))
+        Terminal.lazy_pages = bool(options.get("lazy_terminals"))
+        Terminal.replay_jobs = bool(options.get("replay_jobs"))
+        if self.restore_session:
+            # saved when the window closes, rebuilt right away next start
+            self.connect("delete-event", self.event_delete)
+            if os.path.exists(self.session_path):
+                self.apply_layout(load_layout(self.session_path))
+        for keycode, value in config.get("keybinds", {}).items():
+            for action in keybind_actions(value):
+                self.bind(keycode, action, self.server.internal_command(action))
+        for args in config.get("startup", []):
+            self.run_internal(args)
+
+    def set_scrollback_budget(self, config):
+        self.scrollback_budget = int(config.get("budget_mb", 0) * 1024 * 1024)
+        self.trim_hidden_first = config.get("trim_hidden_first", True)
+        if config.get("pane_lines") is not None:
+            Terminal.scrollback_lines = int(config["pane_lines"])
+            for term in self.terminals():
+                term.set_scrollback_lines(Terminal.scrollback_lines)
+        if self.scrollback_timer:
+            GLib.source_remove(self.scrollback_timer)
+            self.scrollback_timer = None
+        if self.scrollback_budget:
+            self.scrollback_timer = GLib.timeout_add_seconds(
+                int(config.get("interval", 30)), self.event_scrollback_timer
+            )
+
+    def event_scrollback_timer(self):
+        scheduler.schedule(self.enforce_scrollback, priority=LOW, key="scrollback")
+        return True
+
+    def terminals(self):
+        self.refresh_tabs()
+        return [term for tab in self.tabs for term in tab.terminals]
+
+    def memory_info(self):
+        self.refresh_tabs()
+        focused = None
+        if 0 <= self.focused_tab < len(self.tabs):
+            focused = self.tabs[self.focused_tab].curterm()
+        return [term.memory_info(term is focused) for term in self.terminals()]
+
+    def enforce_scrollback(self):
+        if not self.scrollback_budget:
+            return {}
+        trims = scrollback.plan(
+            self.memory_info(), self.scrollback_budget, self.trim_hidden_first
+        )
+        for term_id, keep in trims.items():
+            registry.terminal(term_id).trim_scrollback(keep)
+            search_index.trim(term_id, keep)
+        return trims
+
+    def run_internal(self, args):
+        try:
+            self.server.exec_command(args)
+        except Exception as e:
+            import traceback
+            print(traceback.format_exc())
         
+    def event_delete(self, *args):
+        self.save_session(self.session_path)
+        return False
+
+    def save_session(self, path=None):
+        save_layout(self.snapshot(), path if path else self.session_path)
+
     def event_destroy(self, event=None):
-        send_command(["stop"])
+        if self.server:
+            self.server.stop()
         Gtk.main_quit(event)
 
     def split(self, tab=None, title=None, directory=None, commands=[], orient="v"):
@@ -372,11 +1086,24 @@ class TermIDE(Gtk.Window):
         self.remove(self.content)
         self.content = TermSplit(oldtab, newtab, orient)
         self.add(self.content)    
+        return newtab
         
     def resize(self, step_x, step_y):
         pass
         
     def tab_focused(self, curtabno):
+        self.refresh_tabs()
+        self.focused_tab = curtabno
+        tab = self.tabs[curtabno]
+        # compare panes, after a close the sibling often inherits the tab number
+        if tab.pane_id != self.focused_pane:
+            if self.focused_pane in registry.panes:
+                self.previous_pane = self.focused_pane
+            self.focused_pane = tab.pane_id
+            events.emit(
+                "focus", tab=curtabno, pane=tab.pane_id,
+                term=tab.curterm().term_id, title=tab.curterm().title
+            )
         self.server.current_tab = curtabno
         for tabno, tab in enumerate(self.tabs):
             tab.curterm().set_clear_background(curtabno == tabno)
@@ -387,6 +1114,6 @@ class TermIDE(Gtk.Window):
     def replace_obj(self, oldobj, newobj):
         self.remove(oldobj)
         self.add(newobj)
-        newobj.show()
+        transaction.show(newobj)
         self.content = newobj
 
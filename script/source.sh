@@ -2,5 +2,56 @@
 source /etc/bash.bashrc
 source ~/.bashrc
 
+# one long lived client per shell, "termide" calls reuse its connection
+# instead of starting python every time; set TERMIDE_NO_COPROC to opt out
+if [ -n "$TERMIDE_PIPE_PATH" ] && [ -z "$TERMIDE_NO_COPROC" ] && [ -z "$TERMIDE_COPROC_PID" ]; then
+    coproc TERMIDE_COPROC { exec python3 "$(dirname "$(readlink -f "${BASH_SOURCE[0]}")")/termide-shell"; }
+    # keep it out of the job table, a bare fg would take over the shell
+    disown "$TERMIDE_COPROC_PID"
+    TERMIDE_COPROC_IN=${TERMIDE_COPROC[0]}
+    TERMIDE_COPROC_OUT=${TERMIDE_COPROC[1]}
+
+    termide() {
+        # commands reading stdin, streaming output or waiting on the user or
+        # the terminal keep using the script, ctrl-c there cannot leave a
+        # late reply in the coprocess pipe
+        case "$1" in
+            batch|subscribe|term_get_text|term_wait|prompt|popup) command termide "$@"; return;;
+        esac
+        # only the shell itself talks to the coprocess, subshells ($(...),
+        # pipelines, background jobs) would interleave on the same pipes
+        if [ "$BASHPID" != "$$" ] || ! kill -0 "$TERMIDE_COPROC_PID" 2>/dev/null; then
+            command termide "$@"
+            return
+        fi
+        if [ -n "$TERMIDE_COPROC_BUSY" ]; then
+            # the last call was interrupted, its reply may still be in the
+            # pipe and would be read as ours, so retire the coprocess
+            kill "$TERMIDE_COPROC_PID" 2>/dev/null
+            TERMIDE_COPROC_BUSY=
+            command termide "$@"
+            return
+        fi
+        local status count line
+        TERMIDE_COPROC_BUSY=1
+        {
+            printf '%d\n' "$#"
+            [ "$#" -gt 0 ] && printf '%s\0' "$@"
+        } >&"$TERMIDE_COPROC_OUT"
+        IFS=' ' read -r status count <&"$TERMIDE_COPROC_IN" || { TERMIDE_COPROC_BUSY=; return 2; }
+        while [ "$count" -gt 0 ]; do
+            IFS= read -r line <&"$TERMIDE_COPROC_IN"
+            if [ "$status" = 0 ]; then
+                printf '%s\n' "$line"
+            else
+                printf '%s\n' "$line" >&2
+            fi
+            count=$((count - 1))
+        done
+        TERMIDE_COPROC_BUSY=
+        return "$status"
+    }
+fi
+
 
 
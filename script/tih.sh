@@ -66,12 +66,20 @@ fi
 
 if [ "$1" = "start" ]; then
 	tplname=`ls $PDIR/templates | $PDIR/fzf/fzf/bin/fzf`
-	$PDIR/templates/$tplname
+	if [ "${tplname##*.}" = "json" ]; then
+		termide layout "$PDIR/templates/$tplname"
+	else
+		$PDIR/templates/$tplname
+	fi
 fi
 
 
 if [ "$1" = "tpl" ]; then
     TPLPATH="$PDIR/templates/$2.sh"
+    if [ ! -e "$TPLPATH" ]; then
+        termide layout "$PDIR/templates/$2.json"
+        exit
+    fi
     shift 2
     $TPLPATH "@$"
 fi
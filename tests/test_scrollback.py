@@ -0,0 +1,24 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from includes import scrollback
+
+
+def test_kept_rows_counts_only_what_is_kept():
+    # 100000 rows printed, the ring dropped all but the last 512 + 24
+    assert scrollback.kept_rows(99464, 100000, 24) == 512
+
+
+def test_kept_rows_without_scrollback():
+    assert scrollback.kept_rows(0, 24, 24) == 0
+    assert scrollback.kept_rows(0, 10, 24) == 0
+
+
+def test_plan_keeps_within_kept_rows():
+    terms = [{
+        "key": "t1", "rows": scrollback.kept_rows(99464, 100000, 24),
+        "columns": 100, "hidden": True, "focused": False,
+    }]
+    keep = scrollback.plan(terms, budget=100 * 300 * scrollback.BYTES_PER_CELL)
+    assert keep == {"t1": 300}